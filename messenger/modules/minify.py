@@ -1,8 +1,16 @@
 """Minify message."""
 from reasoner_pydantic import Request, Message
 
+from messenger.shared.executor import EXECUTOR
+
 
 async def query(request: Request) -> Message:
+    """Minify message."""
+    message = await EXECUTOR.run(process, request.message.dict())
+    return Message(**message)
+
+
+def process(message: dict) -> dict:
     """Minify message.
 
     for knowledge graph:
@@ -11,7 +19,6 @@ async def query(request: Request) -> Message:
     for results:
       * keep only qg_id, kg_id
     """
-    message = request.message.dict()
     kgraph = message['knowledge_graph']
     results = message['results']
 
@@ -38,4 +45,4 @@ async def query(request: Request) -> Message:
 
     message['knowledge_graph'] = kgraph
     message['results'] = results
-    return Message(**message)
+    return message
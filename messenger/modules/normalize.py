@@ -1,30 +1,14 @@
 """Normalize node curies."""
-import urllib
-
-import os
-import httpx
+from fastapi import Query
 from reasoner_pydantic import Request, Message
 
-# Makes NN url configurable
-
-NN_URL = os.environ.get("NN_URL", "https://nodenormalization-sri.renci.org/get_normalized_nodes?")
+from messenger.shared import node_normalizer
 
 
-
-def synonymize(*curies):
+async def synonymize(*curies):
     """Return a list of synonymous, preferred curies."""
-    response = httpx.get(
-        NN_URL + '&'.join(f'curie={urllib.parse.quote(curie)}' for curie in curies)
-    )
-    if response.status_code == 404:
-        return curies
-    results = response.json()
-    return [
-        results[curie]['id']['identifier']
-        if results[curie] else
-        curie
-        for curie in curies
-    ]
+    curie_map = await node_normalizer.normalize(curies)
+    return [curie_map[curie] for curie in curies]
 
 
 def ensure_list(list_or_scalar):
@@ -34,9 +18,119 @@ def ensure_list(list_or_scalar):
     return [list_or_scalar]
 
 
-async def query(request: Request) -> Message:
+def remap(kg_id, id_map):
+    """Map binding kg_id, or each of a list of them, dropping duplicates."""
+    if isinstance(kg_id, list):
+        return list(dict.fromkeys(id_map.get(element, element) for element in kg_id))
+    return id_map.get(kg_id, kg_id)
+
+
+def merge_attributes(merged, other):
+    """Add the attributes of other to merged.
+
+    Lists are united, other attributes are kept from merged if present.
+    """
+    for key, value in other.items():
+        if key not in merged:
+            merged[key] = value
+        elif isinstance(merged[key], list) and isinstance(value, list):
+            merged[key] = merged[key] + [
+                element for element in value
+                if element not in merged[key]
+            ]
+
+
+def hashable(value):
+    """Convert binding kg_id or attribute to something hashable."""
+    if isinstance(value, list):
+        return tuple(hashable(element) for element in value)
+    if isinstance(value, dict):
+        return tuple(sorted((key, hashable(element)) for key, element in value.items()))
+    return value
+
+
+def edge_key(edge):
+    """Get identity of edge: source, target, type and provenance."""
+    return tuple(
+        hashable(edge.get(key))
+        for key in ('source_id', 'target_id', 'type', 'source_database', 'edge_source', 'provenance')
+    )
+
+
+def collapse_message(message):
+    """Merge duplicate nodes and edges, and drop duplicate bindings and results.
+
+    Returns a report of the sizes before and after.
+    """
+    kgraph = message['knowledge_graph']
+    results = message.get('results') or []
+    report = {
+        'nodes': [len(kgraph['nodes'])],
+        'edges': [len(kgraph['edges'])],
+        'results': [len(results)],
+    }
+
+    nodes = dict()
+    for node in kgraph['nodes']:
+        if node['id'] in nodes:
+            merge_attributes(nodes[node['id']], node)
+        else:
+            nodes[node['id']] = node
+    kgraph['nodes'] = list(nodes.values())
+
+    edges = dict()
+    edge_ids = dict()
+    for edge in kgraph['edges']:
+        key = edge_key(edge)
+        if key in edges:
+            merge_attributes(edges[key], edge)
+        else:
+            edges[key] = edge
+        edge_ids[edge['id']] = edges[key]['id']
+    kgraph['edges'] = list(edges.values())
+
+    unique_results = dict()
+    for result in results:
+        for binding in result['edge_bindings']:
+            binding['kg_id'] = remap(binding['kg_id'], edge_ids)
+        result_key = []
+        for bindings in ('node_bindings', 'edge_bindings'):
+            unique_bindings = dict()
+            for binding in result[bindings]:
+                unique_bindings.setdefault((binding['qg_id'], hashable(binding['kg_id'])), binding)
+            result[bindings] = list(unique_bindings.values())
+            result_key.append(frozenset(unique_bindings))
+        unique_results.setdefault(tuple(result_key), result)
+    if 'results' in message:
+        message['results'] = list(unique_results.values())
+
+    report['nodes'].append(len(kgraph['nodes']))
+    report['edges'].append(len(kgraph['edges']))
+    report['results'].append(len(unique_results))
+    return {
+        name: {'before': before, 'after': after}
+        for name, (before, after) in report.items()
+    }
+
+
+async def query(
+        request: Request,
+        collapse: bool = Query(
+            False,
+            description='merge duplicate nodes, edges, bindings and results after normalizing',
+        ),
+) -> Message:
     """Normalize."""
-    message = request.message.dict()
+    message = await process(request.message.dict(), collapse=collapse)
+    return Message(**message)
+
+
+async def process(message: dict, *, collapse: bool = False) -> dict:
+    """Normalize.
+
+    If collapse, synonymous nodes are merged afterwards (see collapse_message())
+    and message['collapse'] reports the sizes before and after.
+    """
     qgraph = message['query_graph']
 
     qcuries = {
@@ -57,7 +151,7 @@ async def query(request: Request) -> Message:
     }
     curie_map = dict(zip(
         curies,
-        synonymize(*(curies))
+        await synonymize(*(curies))
     ))
     for node in qgraph['nodes']:
         if not node.get('curie', None):
@@ -70,10 +164,10 @@ async def query(request: Request) -> Message:
     for edge in message['knowledge_graph']['edges']:
         edge['source_id'] = curie_map[edge['source_id']]
         edge['target_id'] = curie_map[edge['target_id']]
-    if 'results' not in message:
-        return message
-    for result in message['results']:
+    for result in message.get('results') or []:
         for binding in result['node_bindings']:
-            binding['kg_id'] = curie_map[binding['kg_id']]
+            binding['kg_id'] = remap(binding['kg_id'], curie_map)
+    if collapse:
+        message['collapse'] = collapse_message(message)
 
-    return Message(**message)
+    return message
@@ -1,23 +1,85 @@
 """Rank."""
+from typing import Optional
+
 from reasoner_pydantic import Request, Message
 
+from messenger.modules import screen
+from messenger.shared.executor import EXECUTOR
 from messenger.shared.util import flatten_semilist
-from messenger.shared.ranker_obj import Ranker
+from messenger.shared.ranker_obj import KirchhoffEstimator, Ranker
+from messenger.shared.score_cache import get_score_cache
+
 
+async def query(
+        request: Request,
+        *,
+        jaccard_like: bool = False,
+        approximate: bool = False,
+        probes: int = 32,
+        seed: Optional[int] = None,
+        error_target: float = 0.05,
+        max_results: int = -1,
+) -> Message:
+    """Score answers."""
+    message = await EXECUTOR.run(
+        process,
+        request.message.dict(),
+        jaccard_like=jaccard_like,
+        approximate=approximate,
+        probes=probes,
+        seed=seed,
+        error_target=error_target,
+        max_results=max_results,
+    )
+    return Message(**message)
 
-async def query(request: Request, *, jaccard_like: bool = False) -> Message:
+
+def process(
+        message: dict,
+        *,
+        jaccard_like: bool = False,
+        approximate: bool = False,
+        probes: int = 32,
+        seed: Optional[int] = None,
+        error_target: float = 0.05,
+        max_results: int = -1,
+) -> dict:
     """Score answers.
 
     This is mostly glue around the heavy lifting in ranker_obj.Ranker
+
+    If approximate is True, the Kirchhoff index of answers with more than
+    probes non-set nodes is estimated from at most probes random probes,
+    stopping early once the relative standard error is below error_target.
+    Every answer then gets a score_error, the standard error of its score.
+
+    Exact scores are memoized across requests, see score_cache.
+
+    If max_results is not negative, only the top max_results answers are
+    kept, and the knowledge graph is pruned as by screen. Answers that
+    provably cannot make the cut are not scored at all.
     """
-    message = request.message.dict()
     kgraph = message['knowledge_graph']
     answers = message['results']
 
+    if approximate:
+        estimator = KirchhoffEstimator(
+            probes=probes,
+            seed=seed,
+            error_target=error_target,
+        )
+    else:
+        estimator = None
+
     # resistance distance ranking
-    pr = Ranker(message)
-    answers = pr.rank(answers, jaccard_like=jaccard_like)
+    pr = Ranker(message, estimator=estimator, cache=get_score_cache())
+    if max_results < 0:
+        answers = pr.rank(answers, jaccard_like=jaccard_like)
+    else:
+        answers = pr.rank_top(answers, max_results, jaccard_like=jaccard_like)
 
     # finish
     message['results'] = answers
-    return Message(**message)
+    if max_results >= 0:
+        message = screen.process(message, max_results=max_results)
+    return message
@@ -6,17 +6,27 @@ import operator
 
 from reasoner_pydantic import Request, Message
 
+from messenger.shared.executor import EXECUTOR
 from messenger.shared.util import flatten_semilist
 
 logger = logging.getLogger(__name__)
 
 
 async def query(request: Request, *, max_results: int = 3) -> Message:
+    """Prescreen subgraphs."""
+    message = await EXECUTOR.run(
+        process,
+        request.message.dict(),
+        max_results=max_results,
+    )
+    return Message(**message)
+
+
+def process(message: dict, *, max_results: int = 3) -> dict:
     """Prescreen subgraphs.
 
     Keep the top max_results, by their total edge weight.
     """
-    message = request.message.dict()
     if max_results < 0:
         return message
 
@@ -46,4 +56,4 @@ async def query(request: Request, *, max_results: int = 3) -> Message:
         message['knowledge_graph'] = kgraph
 
     message['results'] = answers
-    return Message(**message)
+    return message
@@ -6,30 +6,29 @@ from neo4j import GraphDatabase, basic_auth
 from reasoner_pydantic import Request, Message
 
 from messenger.shared.util import random_string
-from messenger.shared.neo4j_ import Neo4jDatabase
+from messenger.shared.neo4j_ import get_database
 
 logger = logging.getLogger(__name__)
 
 
 async def query(request: Request, *, threshold: float = 0.5) -> Message:
     """Fetch answers to question."""
-    message = request.message.dict()
-    driver = Neo4jDatabase(
-        url='http://localhost:7474',
-        credentials={
-            'username': 'neo4j',
-            'password': 'pword',
-        },
-    )
-    message = query_neo4j(
+    message = await process(request.message.dict(), threshold=threshold)
+    return Message(**message)
+
+
+async def process(message: dict, *, threshold: float = 0.5) -> dict:
+    """Fetch answers to question."""
+    driver = get_database()
+    message = await query_neo4j(
         message,
         driver,
         threshold,
     )
-    return Message(**message)
+    return message
 
 
-def query_neo4j(message, driver, threshold):
+async def query_neo4j(message, driver, threshold):
     """Query Neo4j for query nodes similar to anchor node.
     
     {
@@ -99,7 +98,7 @@ def query_neo4j(message, driver, threshold):
             RETURN result, intersection, jaccard ORDER BY jaccard DESC"""
         logger.debug(query_string)
 
-        result = driver.run(query_string)
+        result = await driver.arun(query_string)
 
         answers.extend([{
             "node_bindings": [
@@ -5,61 +5,24 @@ import logging
 import os
 from uuid import uuid4
 
-import asyncio
+import fastapi
+from fastapi import Query
 from reasoner_pydantic import Request, Message
 
-from messenger.shared.cache import Cache
-from messenger.shared.omnicorp import OmnicorpSupport
-from messenger.shared.util import batches
+from messenger.shared.cache_manager import get_cache
+from messenger.shared.omnicorp import COUNT_KEY, OmnicorpSupport
+from messenger.shared.scheduler import cancel_on_disconnect
 
 logger = logging.getLogger(__name__)
 
-CACHE_HOST = os.environ.get('CACHE_HOST', 'localhost')
-CACHE_PORT = os.environ.get('CACHE_PORT', '6379')
-CACHE_DB = os.environ.get('CACHE_DB', '0')
-CACHE_PASSWORD = os.environ.get('CACHE_PASSWORD', '')
-
-
-async def count_node_pmids(supporter, node, key, value, cache):
-    """Count node PMIDs and add as node property."""
-    if value is not None:
-        logger.debug(f'{key} is cached')
-        support_dict = value
-    else:
-        logger.debug(f'Computing {key}...')
-        support_dict = await supporter.node_pmid_count(node['id'])
-        if cache and support_dict['omnicorp_article_count']:
-            cache.set(key, support_dict)
-    # add omnicorp_article_count to nodes in networkx graph
-    node.update(support_dict)
-
-
-async def count_shared_pmids(
-        supporter, support_idx, pair, key, value,
-        cache, cached_prefixes, kgraph, pair_to_answer,
-        answers,
-):
-    """Count PMIDS shared by a pair of nodes and create a new support edge."""
-    support_edge = value
-
-    if support_edge is None:
-        # There are two reasons that we don't get anything back:
-        # 1. We haven't evaluated that pair
-        # 2. We evaluated, and found it to be zero, and it was part
-        #    of a prefix pair that we evaluated all of.  In that case
-        #    we can infer that getting nothing back means an empty list
-        #    check cached_prefixes for this...
-        prefixes = tuple(ident.split(':')[0].upper() for ident in pair)
-        if cached_prefixes and prefixes in cached_prefixes:
-            logger.debug(f'{pair} should be cached: assume 0')
-            support_edge = []
-        else:
-            logger.debug(f'Computing {pair}...')
-            support_edge = await supporter.term_to_term_pmid_count(pair[0], pair[1])
-            if cache and support_edge:
-                cache.set(key, support_edge)
-    else:
-        logger.debug(f'{pair} is cached')
+# in "auto" mode, estimate counts if more pairs than this are not cached
+SUPPORT_APPROXIMATE_ABOVE = int(os.environ.get('SUPPORT_APPROXIMATE_ABOVE', '100000'))
+# default maximum number of pairs supported per message, -1 for all
+SUPPORT_MAX_PAIRS = int(os.environ.get('SUPPORT_MAX_PAIRS', '-1'))
+
+
+def add_support_edge(support_idx, pair, support_edge, kgraph, pair_to_answer, answers, estimated=False):
+    """Create a new support edge for a pair of nodes, if they share PMIDs."""
     if not support_edge:
         return
     uid = str(uuid4())
@@ -67,6 +30,7 @@ async def count_shared_pmids(
         'type': 'literature_co-occurrence',
         'id': uid,
         'num_publications': support_edge,
+        'num_publications_estimated': estimated,
         'publications': [],
         'source_database': 'omnicorp',
         'source_id': pair[0],
@@ -81,79 +45,187 @@ async def count_shared_pmids(
         })
 
 
-async def query(request: Request) -> Message:
+def plan_pairs(answers, max_pairs=-1, prioritize='score'):
+    """Get the node pairs to support, within a budget of max_pairs.
+
+    The nodes of each answer that are not in sets are densely connected,
+    and each set member is connected to every node that is not in a set.
+    If there are more than max_pairs (>= 0) unique pairs, pairs are kept in
+    order of the best score of their answers (if prioritize is "score"),
+    pairs without set members first, then by position within the set,
+    then by answer.
+    Returns a map of kept pairs to answer indices, and the skipped pairs.
+    """
+    pair_to_answer = defaultdict(set)  # a map of node pairs to answers
+    priorities = dict()
+
+    def add_pair(node_pair, ans_idx, priority):
+        """Add pair, keeping its best priority."""
+        pair_to_answer[node_pair].add(ans_idx)
+        priorities[node_pair] = min(priorities.get(node_pair, priority), priority)
+
+    for ans_idx, answer_map in enumerate(answers):
+        score = (answer_map.get('score') or 0) if prioritize == 'score' else 0
+
+        # Get all nodes that are not part of sets and densely connect them
+        nodes = sorted([nb['kg_id'] for nb in answer_map['node_bindings'] if isinstance(nb['kg_id'], str)])
+        for node_pair in combinations(nodes, 2):
+            add_pair(node_pair, ans_idx, (-score, 0, ans_idx))
+
+        # For all nodes that are within sets, connect them to all nodes that are not in sets
+        set_nodes_list_list = [nb['kg_id'] for nb in answer_map['node_bindings'] if isinstance(nb['kg_id'], list)]
+        set_nodes = [n for el in set_nodes_list_list for n in el]
+        for set_idx, set_node in enumerate(set_nodes):
+            for node in nodes:
+                node_pair = tuple(sorted((node, set_node)))
+                add_pair(node_pair, ans_idx, (-score, set_idx + 1, ans_idx))
+
+    if max_pairs < 0 or len(pair_to_answer) <= max_pairs:
+        return pair_to_answer, []
+    ranked = sorted(pair_to_answer, key=priorities.get)
+    kept = set(ranked[:max_pairs])
+    return (
+        {pair: ans_idxs for pair, ans_idxs in pair_to_answer.items() if pair in kept},
+        ranked[max_pairs:],
+    )
+
+
+async def query(
+        request: Request,
+        raw_request: fastapi.Request,
+        mode: str = Query(
+            'exact',
+            regex='^(exact|approximate|auto)$',
+            description=(
+                'count shared publications exactly, estimate them from '
+                'MinHash sketches, or estimate them above approximate_above pairs'
+            ),
+        ),
+        approximate_above: int = Query(
+            SUPPORT_APPROXIMATE_ABOVE,
+            description='in auto mode, number of uncached pairs above which counts are estimated',
+        ),
+        max_pairs: int = Query(
+            SUPPORT_MAX_PAIRS,
+            description='maximum number of node pairs to support, or -1 for all',
+        ),
+        prioritize: str = Query(
+            'score',
+            regex='^(score|order)$',
+            description='keep pairs of the best-scoring answers, or by set-membership order',
+        ),
+) -> Message:
+    """Add support to message."""
+    async with cancel_on_disconnect(raw_request):
+        message = await process(
+            request.message.dict(),
+            mode=mode,
+            approximate_above=approximate_above,
+            max_pairs=max_pairs,
+            prioritize=prioritize,
+        )
+    return Message(**message)
+
+
+async def process(
+        message: dict,
+        *,
+        mode: str = 'exact',
+        approximate_above: int = SUPPORT_APPROXIMATE_ABOVE,
+        max_pairs: int = SUPPORT_MAX_PAIRS,
+        prioritize: str = 'score',
+) -> dict:
     """Add support to message.
 
     Add support edges to knowledge_graph and bindings to results.
+    Estimated counts (see omnicorp_sketch) are not cached. Without
+    sketches, pairs are counted exactly in every mode.
+    Pairs beyond the budget (see plan_pairs) are listed in
+    message['support_plan'].
     """
-    message = request.message.dict()
 
     kgraph = message['knowledge_graph']
     qgraph = message['query_graph']
     answers = message['results']
 
-    # get cache if possible
-    try:
-        cache = Cache(
-            redis_host=CACHE_HOST,
-            redis_port=CACHE_PORT,
-            redis_db=CACHE_DB,
-            redis_password=CACHE_PASSWORD,
-        )
-    except Exception as err:
-        logger.exception(err)
-        cache = None
+    pair_to_answer, skipped = plan_pairs(answers, max_pairs=max_pairs, prioritize=prioritize)
+    logger.debug(f'Planned {len(pair_to_answer)} pairs, skipped {len(skipped)}.')
+    message['support_plan'] = {
+        'pairs': len(pair_to_answer) + len(skipped),
+        'max_pairs': max_pairs,
+        'skipped': [list(pair) for pair in skipped],
+    }
 
-    redis_batch_size = 100
+    cache = get_cache()
+    node_cache = cache['node_counts']
+    pair_cache = cache['pair_counts']
 
-    async with OmnicorpSupport() as supporter:
+    # new counts reach the disk and Redis tiers in one batch per namespace, at the end
+    async with cache.write_buffer(), OmnicorpSupport() as supporter:
         # get all node supports
 
-        keys = [f"{supporter.__class__.__name__}({node['id']})" for node in kgraph['nodes']]
-        values = []
-        for batch in batches(keys, redis_batch_size):
-            values.extend(cache.mget(*batch))
-
-        jobs = [
-            count_node_pmids(supporter, node, key, value, cache)
-            for node, value, key in zip(kgraph['nodes'], values, keys)
-        ]
-
-        # Generate a set of pairs of node curies
-        pair_to_answer = defaultdict(set)  # a map of node pairs to answers
-        for ans_idx, answer_map in enumerate(answers):
-
-            # Get all nodes that are not part of sets and densely connect them
-            nodes = sorted([nb['kg_id'] for nb in answer_map['node_bindings'] if isinstance(nb['kg_id'], str)])
-            for node_pair in combinations(nodes, 2):
-                pair_to_answer[node_pair].add(ans_idx)
-
-            # For all nodes that are within sets, connect them to all nodes that are not in sets
-            set_nodes_list_list = [nb['kg_id'] for nb in answer_map['node_bindings'] if isinstance(nb['kg_id'], list)]
-            set_nodes = [n for el in set_nodes_list_list for n in el]
-            for set_node in set_nodes:
-                for node in nodes:
-                    node_pair = tuple(sorted((node, set_node)))
-                    pair_to_answer[node_pair].add(ans_idx)
+        keys = [node['id'] for node in kgraph['nodes']]
+        values = await node_cache.mget(keys)
+
+        # count all uncached nodes in bulk
+        uncached = [key for key, value in zip(keys, values) if value is None]
+        logger.debug(f'Computing {len(uncached)} nodes...')
+        node_counts = await supporter.node_pmid_count_many(uncached)
+        await node_cache.mset({
+            key: node_counts[key][COUNT_KEY]
+            for key in uncached
+        })
+        for node, value in zip(kgraph['nodes'], values):
+            # add omnicorp_article_count to nodes in networkx graph
+            node.update({COUNT_KEY: value} if value is not None else node_counts[node['id']])
 
         # get all pair supports
-        cached_prefixes = cache.get('OmnicorpPrefixes') if cache else None
-
-        keys = [f"{supporter.__class__.__name__}_count({pair[0]},{pair[1]})" for pair in pair_to_answer]
-        values = []
-        for batch in batches(keys, redis_batch_size):
-            values.extend(cache.mget(*batch))
-
-        jobs.extend([
-            count_shared_pmids(
-                supporter, support_idx, pair, key, value,
-                cache, cached_prefixes, kgraph, pair_to_answer,
-                answers,
+        cached_prefixes = await cache['metadata'].get('OmnicorpPrefixes')
+
+        keys = [f"{pair[0]},{pair[1]}" for pair in pair_to_answer]
+        values = await pair_cache.mget(keys)
+
+        # There are two reasons that we don't get anything back:
+        # 1. We haven't evaluated that pair
+        # 2. We evaluated, and found it to be zero, and it was part
+        #    of a prefix pair that we evaluated all of.  In that case
+        #    we can infer that getting nothing back means an empty list
+        #    check cached_prefixes for this...
+        uncached = dict()
+        for pair, value, key in zip(pair_to_answer, values, keys):
+            if value is not None:
+                logger.debug(f'{pair} is cached')
+                continue
+            prefixes = tuple(ident.split(':')[0].upper() for ident in pair)
+            if cached_prefixes and prefixes in cached_prefixes:
+                logger.debug(f'{pair} should be cached: assume 0')
+                continue
+            uncached[pair] = key
+
+        estimated = mode == 'approximate' or (mode == 'auto' and len(uncached) > approximate_above)
+        if estimated and not supporter.can_estimate():
+            logger.warning('Omnicorp sketches are not available, counting pairs exactly.')
+            estimated = False
+        if estimated:
+            # estimate all uncached pairs
+            logger.debug(f'Estimating {len(uncached)} pairs...')
+            counts = await supporter.term_to_term_pmid_count_estimates(list(uncached))
+        else:
+            # count all uncached pairs in bulk
+            logger.debug(f'Computing {len(uncached)} pairs...')
+            counts = await supporter.term_to_term_pmid_count_many(list(uncached))
+            await pair_cache.mset({
+                key: counts[pair]
+                for pair, key in uncached.items()
+            })
+
+        for support_idx, (pair, value) in enumerate(zip(pair_to_answer, values)):
+            support_edge = value if value is not None else counts.get(pair, 0)
+            add_support_edge(
+                support_idx, pair, support_edge, kgraph, pair_to_answer, answers,
+                estimated=estimated and pair in uncached,
             )
-            for support_idx, (pair, value, key) in enumerate(zip(pair_to_answer, values, keys))
-        ])
-        await asyncio.gather(*jobs)
 
     message['knowledge_graph'] = kgraph
     message['results'] = answers
-    return Message(**message)
+    return message
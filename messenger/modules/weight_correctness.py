@@ -6,6 +6,8 @@ from typing import Optional
 from fastapi import Query
 from reasoner_pydantic import Request, Message
 
+from messenger.shared.executor import EXECUTOR
+
 
 async def query(
         request: Request,
@@ -26,13 +28,31 @@ async def query(
             description='pubs at 50% of wt_max',
         ),
 ) -> Message:
+    """Weight kgraph edges based on metadata."""
+    message = await EXECUTOR.run(
+        process,
+        request.message.dict(),
+        relevance=relevance,
+        wt_min=wt_min,
+        wt_max=wt_max,
+        p50=p50,
+    )
+    return Message(**message)
+
+
+def process(
+        message: dict,
+        *,
+        relevance: float = 0.0025,
+        wt_min: float = 0.0,
+        wt_max: float = 1.0,
+        p50: float = 2.0,
+) -> dict:
     """Weight kgraph edges based on metadata.
 
     "19 pubs from CTD is a 1, and 2 should at least be 0.5"
         - cbizon
     """
-    message = request.message.dict()
-
     def sigmoid(x):
         """Scale with partial sigmoid - the right (concave down) half.
 
@@ -95,4 +115,4 @@ async def query(
             redge['weight'] = redge.get('weight', 1.0) * sigmoid(effective_pubs)
 
     message['knowledge_graph'] = kgraph
-    return Message(**message)
+    return message
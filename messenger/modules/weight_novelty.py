@@ -1,7 +1,6 @@
 """Novelty."""
 import copy
 import logging
-import os
 import time
 import uuid
 from collections import defaultdict
@@ -11,14 +10,10 @@ from neo4j import GraphDatabase, basic_auth
 
 from messenger.shared.qgraph_compiler import NodeReference, EdgeReference
 from messenger.shared.util import batches
-from messenger.shared.neo4j_ import Neo4jDatabase
+from messenger.shared.neo4j_ import get_database
 
 logger = logging.getLogger(__name__)
 
-NEO4J_URL = os.environ.get('NEO4J_URL', 'http://localhost:7474')
-NEO4J_USER = os.environ.get('NEO4J_USER', 'neo4j')
-NEO4J_PASSWORD = os.environ.get('NEO4J_PASSWORD', 'pword')
-
 
 def get_rgraph(result, message):
     """Get "ranker" subgraph."""
@@ -87,7 +82,12 @@ def get_rgraph(result, message):
 
 async def query(request: Request, *, exclude_sets=False) -> Message:
     """Compute informativeness weights for edges."""
-    message = request.message.dict()
+    message = await process(request.message.dict(), exclude_sets=exclude_sets)
+    return Message(**message)
+
+
+async def process(message: dict, *, exclude_sets=False) -> dict:
+    """Compute informativeness weights for edges."""
     qgraph = message['query_graph']
     results = message['results']
 
@@ -98,13 +98,7 @@ async def query(request: Request, *, exclude_sets=False) -> Message:
     qnode_map = {qnode['id']: qnode for qnode in qnodes}
     qedge_map = {qedge['id']: qedge for qedge in qedges}
 
-    driver = Neo4jDatabase(
-        url=NEO4J_URL,
-        credentials={
-            'username': NEO4J_USER,
-            'password': NEO4J_PASSWORD,
-        },
-    )
+    driver = get_database()
     redges_by_id = dict()
     count_plans = defaultdict(lambda: defaultdict(list))
     for kdx, result in enumerate(results):
@@ -158,7 +152,7 @@ async def query(request: Request, *, exclude_sets=False) -> Message:
                 sets.append(f'MATCH ({source_reference}){edge_reference}({target_reference})' + ' RETURN {' + ', '.join(cypher_counts) + '} as output')
             batch_bits.append(' UNION ALL '.join(sets))
         cypher = ' UNION ALL '.join(batch_bits)
-        response = driver.run(cypher)
+        response = await driver.arun(cypher)
 
         degrees = {
             key: value
@@ -172,4 +166,4 @@ async def query(request: Request, *, exclude_sets=False) -> Message:
                 eb['weight'] = eb.get('weight', 1.0) / degrees[key]
 
     message['results'] = results
-    return Message(**message)
+    return message
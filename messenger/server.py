@@ -1,16 +1,29 @@
 """ROBOKOP messenger server."""
+from enum import Enum
 from functools import wraps
 from importlib import import_module
+import inspect
 import logging
 import logging.config
 import os
+import random
 import pkg_resources
 
-from fastapi import FastAPI
+from typing import Any, Dict, List
+
+from fastapi import Body, FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+import orjson
+from pydantic import BaseModel, ValidationError
 from reasoner_pydantic import Message
+from starlette.responses import Response
 import yaml
 
+from messenger.shared import neo4j_, node_normalizer, omnicorp_postgres, stats
+from messenger.shared.cache_manager import get_cache
+from messenger.shared.executor import EXECUTOR
+from messenger.shared.scheduler import cancel_on_disconnect
+
 # Set up default logger.
 with pkg_resources.resource_stream('messenger', 'logging.yml') as f:
     config = yaml.safe_load(f.read())
@@ -22,6 +35,11 @@ logging.config.dictConfig(config)
 
 LOGGER = logging.getLogger(__name__)
 
+# comma-separated operations to serve without pydantic, or "*" for all
+FAST_OPERATIONS = os.environ.get('MESSENGER_FAST_OPERATIONS', '')
+# fraction of fast-path requests that are validated anyway
+VALIDATION_SAMPLE_RATE = float(os.environ.get('MESSENGER_VALIDATION_SAMPLE_RATE', '0'))
+
 APP = FastAPI(
     title='ROBOKOP Messenger',
     version='2.1.0',
@@ -49,14 +67,172 @@ def log_exception(method):
         """Log exception encountered in method, then pass."""
         try:
             return await method(*args, **kwargs)
+        except HTTPException:
+            # e.g. bad client input, nothing to log
+            raise
         except Exception as err:  # pylint: disable=broad-except
             LOGGER.exception(err)
             raise
     return wrapper
 
 
-for operation in operations:
-    md = import_module(f"messenger.modules.{operation}")
-    APP.post('/' + operation, response_model=Message)(
-        log_exception(md.query)
+def is_fast(operation, fast_operations=FAST_OPERATIONS):
+    """Check whether operation skips message validation."""
+    fast_operations = {op.strip() for op in fast_operations.split(',')}
+    return '*' in fast_operations or operation in fast_operations
+
+
+def fast_endpoint(operation):
+    """Build endpoint that works on the raw JSON message.
+
+    The message is neither validated on the way in nor on the way out,
+    except for a VALIDATION_SAMPLE_RATE fraction of requests.
+    Query parameters are taken from the module's query() signature,
+    so they are parsed exactly as by the validating endpoint.
+    The operation is cancelled if the client disconnects.
+    """
+    async def endpoint(raw_request: Request, **kwargs) -> Response:
+        """Run operation on raw message."""
+        try:
+            message = orjson.loads(await raw_request.body())['message']
+        except (orjson.JSONDecodeError, KeyError, TypeError):
+            raise HTTPException(
+                status_code=422,
+                detail='Request body must be a JSON object with a "message".',
+            )
+        validate = random.random() < VALIDATION_SAMPLE_RATE
+        if validate:
+            try:
+                Message.parse_obj(message)
+            except ValidationError as err:
+                raise HTTPException(status_code=422, detail=err.errors())
+        async with cancel_on_disconnect(raw_request):
+            message = await run_operation(operation, message, kwargs)
+        if validate:
+            Message.parse_obj(message)
+        return Response(
+            orjson.dumps(message, option=orjson.OPT_SERIALIZE_NUMPY),
+            media_type='application/json',
+        )
+
+    signature = inspect.signature(modules[operation].query)
+    endpoint.__signature__ = signature.replace(
+        parameters=[
+            inspect.Parameter(
+                'raw_request',
+                inspect.Parameter.POSITIONAL_OR_KEYWORD,
+                annotation=Request,
+            ),
+            *(
+                parameter
+                for name, parameter in signature.parameters.items()
+                if name not in ('request', 'raw_request')
+            ),
+        ],
+        return_annotation=Response,
     )
+    endpoint.__name__ = operation
+    endpoint.__doc__ = modules[operation].query.__doc__
+    return endpoint
+
+
+def add_operations(app, fast_operations=FAST_OPERATIONS):
+    """Add an endpoint per operation to app.
+
+    Operations in fast_operations (comma-separated, or "*" for all)
+    get fast endpoints, see fast_endpoint().
+    """
+    for operation, md in modules.items():
+        if is_fast(operation, fast_operations):
+            app.post('/' + operation, response_class=Response)(
+                log_exception(fast_endpoint(operation))
+            )
+        else:
+            app.post('/' + operation, response_model=Message)(
+                log_exception(md.query)
+            )
+
+
+modules = {
+    operation: import_module(f"messenger.modules.{operation}")
+    for operation in operations
+}
+add_operations(APP)
+
+
+Operation = Enum('Operation', {operation: operation for operation in operations})
+
+
+class Step(BaseModel):
+    """Pipeline step."""
+
+    operation: Operation
+    parameters: Dict[str, Any] = {}
+
+
+class PipelineRequest(BaseModel):
+    """Pipeline request."""
+
+    message: Message
+    operations: List[Step]
+
+
+async def run_operation(operation, message, parameters):
+    """Run operation on message dict."""
+    return await EXECUTOR.run(modules[operation].process, message, **parameters)
+
+
+async def pipeline(request: PipelineRequest) -> Message:
+    """Run a sequence of operations on a single in-memory message.
+
+    The message is validated once on the way in and once on the way out.
+    """
+    steps = [(step.operation.value, step.parameters) for step in request.operations]
+    for operation, parameters in steps:
+        try:
+            inspect.signature(modules[operation].process).bind(None, **parameters)
+        except TypeError as err:
+            raise HTTPException(
+                status_code=422,
+                detail=f'Bad parameters for operation "{operation}": {err}',
+            )
+    message = request.message.dict()
+    for operation, parameters in steps:
+        message = await run_operation(operation, message, parameters)
+    return Message(**message)
+
+
+APP.post('/pipeline', response_model=Message)(
+    log_exception(pipeline)
+)
+APP.on_event('startup')(omnicorp_postgres.startup)
+APP.on_event('startup')(neo4j_.startup)
+APP.on_event('shutdown')(omnicorp_postgres.shutdown)
+APP.on_event('shutdown')(neo4j_.shutdown)
+APP.on_event('shutdown')(node_normalizer.close)
+APP.on_event('shutdown')(EXECUTOR.shutdown)
+
+
+async def get_stats(prefix: str = '') -> Dict[str, float]:
+    """Get runtime statistics of the worker serving this request."""
+    return stats.snapshot(prefix)
+
+
+APP.get('/stats')(get_stats)
+
+
+async def get_cache_stats() -> Dict[str, Dict[str, Any]]:
+    """Get configuration, size and statistics of the cache of the worker serving this request."""
+    return get_cache().info()
+
+
+APP.get('/cache/stats')(get_cache_stats)
+
+
+async def invalidate_normalization(curies: List[str] = Body(None)):
+    """Remove curies, or all curies if none are given, from the normalization cache."""
+    await node_normalizer.invalidate(curies)
+    return {'invalidated': 'all' if curies is None else len(curies)}
+
+
+APP.delete('/cache/normalization')(invalidate_normalization)
@@ -2,6 +2,8 @@
 import logging
 import os
 import pickle
+
+import msgpack
 import redis
 from lru import LRU
 
@@ -20,6 +22,43 @@ class PickleCacheSerializer():
         return pickle.loads(string)
 
 
+class IntCacheSerializer():
+    """Store integers as decimal strings.
+
+    Redis keeps such strings as integers.
+    """
+
+    def dumps(self, obj):
+        """Return stringified integer."""
+        return str(int(obj)).encode()
+
+    def loads(self, string):
+        """Load integer from string."""
+        return int(string)
+
+
+class MsgpackCacheSerializer():
+    """Use MessagePack serialization.
+
+    Much smaller than pickle for small objects, but tuples load as lists.
+    """
+
+    def dumps(self, obj):
+        """Return packed object."""
+        return msgpack.packb(obj, use_bin_type=True)
+
+    def loads(self, string):
+        """Load object from packed string."""
+        return msgpack.unpackb(string, raw=False)
+
+
+SERIALIZERS = {
+    'pickle': PickleCacheSerializer,
+    'int': IntCacheSerializer,
+    'msgpack': MsgpackCacheSerializer,
+}
+
+
 class Cache:
     """Cache objects by configurable means."""
 
@@ -125,6 +164,24 @@ class Cache:
                 stream.write(self.serializer.dumps(value))
             self.cache[key] = value
 
+    def mset(self, mapping):
+        """Add multiple items to the cache."""
+        if not self.enabled:
+            return
+        mapping = {key: value for key, value in mapping.items() if value is not None}
+        if self.redis:
+            if mapping:
+                self.redis.mset({
+                    key: self.serializer.dumps(value)
+                    for key, value in mapping.items()
+                })
+            for key, value in mapping.items():
+                self.cache[key] = value
+        elif self.cache_path is not None:
+            for key, value in mapping.items():
+                self.set(key, value)
+
     def flush(self):
         """Flush redis cache."""
         self.redis.flushdb()
+
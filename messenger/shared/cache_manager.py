@@ -0,0 +1,673 @@
+"""Process-wide multi-tier cache.
+
+Keys are grouped in namespaces. Each namespace looks keys up in three tiers:
+
+1. an in-process tier, bounded by the estimated memory of its entries,
+2. a local directory, if CACHE_DISK_PATH is set, bounded by its disk usage,
+3. Redis, shared by all workers.
+
+Hits in a lower tier are copied to the tiers above it.
+Each namespace has its own time-to-live, in-process eviction policy,
+serializer and Redis layout, configured by CACHE_<NAMESPACE>_TTL
+(seconds, 0 for none), CACHE_<NAMESPACE>_BYTES, CACHE_<NAMESPACE>_POLICY
+("lru" or "fifo"), CACHE_<NAMESPACE>_DISK_BYTES,
+CACHE_<NAMESPACE>_SERIALIZER (see cache.SERIALIZERS) and
+CACHE_<NAMESPACE>_BUCKETS.
+
+Disk tiers are read and written in threads, off the event loop. When a
+disk tier outgrows its size, a background sweep removes expired files
+and then the oldest files until it is below DISK_LOW_WATERMARK of its size.
+
+With buckets, values are stored as fields of Redis hashes
+"<namespace>:<bucket>", chosen by key hash. Small hashes are stored
+compactly by Redis, so this takes a fraction of the memory of one
+top-level key per value. The TTL then applies to the bucket and is
+renewed on each write to it. Without buckets, each value has its own
+key "<namespace>:<key>" and TTL; the metadata namespace keeps the bare
+keys of earlier versions. Eviction beyond the TTLs is up to the server's
+maxmemory-policy.
+
+Namespaces with a legacy key format also read values from the pickled
+top-level keys written by earlier versions (if CACHE_LEGACY_READ is set),
+and migrate them to the new layout.
+
+Within CacheManager.write_buffer(), e.g. for the duration of a request,
+writes only go to the in-process tier at once. The disk and Redis writes
+are buffered and flushed at the end, as one batch per namespace.
+
+Hits, misses and Redis latency are counted in stats, under
+"cache.<namespace>.".
+"""
+import asyncio
+from collections import OrderedDict, defaultdict
+from contextlib import asynccontextmanager
+import contextvars
+import hashlib
+import logging
+from operator import itemgetter
+import os
+import time
+
+import redis
+import redis.asyncio
+
+from messenger.shared import stats
+from messenger.shared.cache import SERIALIZERS, PickleCacheSerializer
+from messenger.shared.util import batches
+
+logger = logging.getLogger(__name__)
+
+CACHE_HOST = os.environ.get('CACHE_HOST', 'localhost')
+CACHE_PORT = os.environ.get('CACHE_PORT', '6379')
+CACHE_DB = os.environ.get('CACHE_DB', '0')
+CACHE_PASSWORD = os.environ.get('CACHE_PASSWORD', '')
+CACHE_DISK_PATH = os.environ.get('CACHE_DISK_PATH', '')
+# seconds to wait before retrying an unreachable Redis
+CACHE_REDIS_RETRY = float(os.environ.get('CACHE_REDIS_RETRY', '30'))
+
+# buffered disk and Redis writes of the current context, see write_buffer
+WRITE_BUFFER = contextvars.ContextVar('cache_write_buffer', default=None)
+# maximum number of keys sent with one Redis command
+CACHE_BATCH_SIZE = int(os.environ.get('CACHE_BATCH_SIZE', '1000'))
+CACHE_LEGACY_READ = os.environ.get('CACHE_LEGACY_READ', 'true').lower() in ('1', 'true', 'yes')
+
+DAY = 24 * 60 * 60
+MEGABYTE = 2**20
+# approximate memory of an in-process entry besides its key and value data:
+# the key and value objects, the entry tuple and the OrderedDict slot
+ENTRY_OVERHEAD = 256
+# disk usage of small files
+DISK_BLOCK_SIZE = 4096
+# fraction of its size that a full disk tier is swept down to
+DISK_LOW_WATERMARK = 0.9
+NAMESPACES = {
+    'node_counts': {
+        'ttl': 30 * DAY,
+        'max_bytes': 16 * MEGABYTE,
+        'disk_bytes': 256 * MEGABYTE,
+        'serializer': 'int',
+        'buckets': 2**16,
+        'legacy_key': 'OmnicorpSupport({})',
+        'legacy_value': itemgetter('omnicorp_article_count'),
+    },
+    'pair_counts': {
+        'ttl': 30 * DAY,
+        'max_bytes': 64 * MEGABYTE,
+        'disk_bytes': 1024 * MEGABYTE,
+        'serializer': 'int',
+        'buckets': 2**22,
+        'legacy_key': 'OmnicorpSupport_count({})',
+    },
+    'normalization': {
+        'ttl': DAY,
+        'max_bytes': 16 * MEGABYTE,
+        'disk_bytes': 256 * MEGABYTE,
+        'serializer': 'msgpack',
+        'buckets': 2**16,
+    },
+    'degrees': {
+        'ttl': 7 * DAY,
+        'max_bytes': 16 * MEGABYTE,
+        'disk_bytes': 256 * MEGABYTE,
+        'serializer': 'int',
+        'buckets': 2**16,
+    },
+    'metadata': {
+        'ttl': DAY,
+        'max_bytes': MEGABYTE,
+        'disk_bytes': 16 * MEGABYTE,
+        # e.g. OmnicorpPrefixes, as written by earlier versions
+        'key_prefix': '',
+    },
+}
+
+
+def namespace_config(name, config):
+    """Apply environment overrides to namespace configuration."""
+    prefix = f'CACHE_{name.upper()}'
+    config = dict(config)
+    for option, variable, parse in (
+            ('ttl', 'TTL', int),
+            ('max_bytes', 'BYTES', int),
+            ('policy', 'POLICY', str),
+            ('disk_bytes', 'DISK_BYTES', int),
+            ('serializer', 'SERIALIZER', str),
+            ('buckets', 'BUCKETS', int),
+    ):
+        value = os.environ.get(f'{prefix}_{variable}')
+        if value is not None:
+            config[option] = parse(value)
+    return config
+
+
+def disk_usage(size):
+    """Estimate disk usage of a file of size bytes."""
+    return -(-size // DISK_BLOCK_SIZE) * DISK_BLOCK_SIZE
+
+
+class MemoryTier():
+    """In-process tier, bounded by the estimated memory of its entries."""
+
+    def __init__(self, max_bytes, policy='lru'):
+        """Create in-process tier."""
+        if policy not in ('lru', 'fifo'):
+            raise ValueError(f'Unknown eviction policy "{policy}"')
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.bytes = 0
+        # key: (value, size, expiry time or 0)
+        self.entries = OrderedDict()
+
+    def __len__(self):
+        """Get number of entries."""
+        return len(self.entries)
+
+    def get(self, key, now):
+        """Get value, or None if it is missing or expired."""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        value, _, expires = entry
+        if expires and expires < now:
+            self.pop(key)
+            return None
+        if self.policy == 'lru':
+            self.entries.move_to_end(key)
+        return value
+
+    def set(self, key, value, size, expires):
+        """Add value, evicting entries until the tier fits in max_bytes.
+
+        size is the size of the serialized value; the entry is counted
+        with its key and ENTRY_OVERHEAD.
+        """
+        self.pop(key)
+        size += len(key) + ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+        self.entries[key] = (value, size, expires)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            _, (_, evicted, _) = self.entries.popitem(last=False)
+            self.bytes -= evicted
+
+    def pop(self, key):
+        """Remove key."""
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[1]
+
+
+class Namespace():
+    """Cached key namespace."""
+
+    def __init__(
+            self,
+            manager,
+            name,
+            ttl=0,
+            max_bytes=MEGABYTE,
+            policy='lru',
+            disk_bytes=256 * MEGABYTE,
+            serializer='pickle',
+            buckets=0,
+            key_prefix=None,
+            legacy_key=None,
+            legacy_value=None,
+    ):
+        """Create namespace.
+
+        Without buckets, Redis keys are prefixed with key_prefix,
+        "<name>:" by default.
+        """
+        self.manager = manager
+        self.name = name
+        self.ttl = ttl
+        self.memory = MemoryTier(max_bytes, policy)
+        self.serializer = SERIALIZERS[serializer]()
+        self.buckets = buckets
+        self.key_prefix = f'{name}:' if key_prefix is None else key_prefix
+        self.legacy_key = legacy_key
+        self.legacy_value = legacy_value
+        self.disk_path = None
+        self.disk_bytes = disk_bytes
+        # estimated disk usage, measured by sweep(), or None until then
+        self.disk_usage = None
+        # running sweep
+        self.sweeping = None
+        if manager.disk_path:
+            self.disk_path = os.path.join(manager.disk_path, name)
+            os.makedirs(self.disk_path, exist_ok=True)
+
+    def count(self, event, value=1):
+        """Increment namespace counter."""
+        stats.increment(f'cache.{self.name}.{event}', value)
+
+    def expiry(self, now):
+        """Get expiry time of values set now."""
+        return now + self.ttl if self.ttl else 0
+
+    def bucket(self, key):
+        """Get Redis hash of key."""
+        digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+        return f'{self.name}:{int.from_bytes(digest, "little") % self.buckets}'
+
+    def redis_key(self, key):
+        """Get Redis key of key, without buckets."""
+        return self.key_prefix + key
+
+    def path(self, key):
+        """Get path of key in the disk tier."""
+        digest = hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+        return os.path.join(self.disk_path, digest)
+
+    def read(self, keys, now):
+        """Read serialized values from the disk tier, None for misses."""
+        records = []
+        for key in keys:
+            path = self.path(key)
+            try:
+                if self.ttl and os.path.getmtime(path) + self.ttl < now:
+                    os.remove(path)
+                    records.append(None)
+                    continue
+                with open(path, 'rb') as stream:
+                    records.append(stream.read())
+            except FileNotFoundError:
+                records.append(None)
+        return records
+
+    def write(self, records):
+        """Write serialized values to the disk tier.
+
+        Returns the disk usage added.
+        """
+        added = 0
+        for key, data in records.items():
+            with open(self.path(key), 'wb') as stream:
+                stream.write(data)
+            added += disk_usage(len(data))
+        return added
+
+    def remove(self, keys=None):
+        """Remove keys, or all keys, from the disk tier."""
+        if keys is None:
+            paths = [entry.path for entry in os.scandir(self.disk_path)]
+        else:
+            paths = [self.path(key) for key in keys]
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    async def disk_read(self, keys, now):
+        """Read serialized values from the disk tier in a thread."""
+        if self.disk_usage is None:
+            self.start_sweep()
+        return await asyncio.get_event_loop().run_in_executor(None, self.read, keys, now)
+
+    async def disk_write(self, records):
+        """Write serialized values to the disk tier in a thread, sweeping it if it is full."""
+        added = await asyncio.get_event_loop().run_in_executor(None, self.write, records)
+        if self.disk_usage is None:
+            self.start_sweep()
+            return
+        self.disk_usage += added
+        if self.disk_usage > self.disk_bytes:
+            self.start_sweep()
+
+    def start_sweep(self):
+        """Sweep the disk tier in a thread, unless a sweep is running."""
+        if self.sweeping is not None and not self.sweeping.done():
+            return
+
+        def done(future):
+            """Record results of sweep."""
+            if future.cancelled() or future.exception() is not None:
+                return
+            self.disk_usage, expired, evicted = future.result()
+            self.count('disk_expired', expired)
+            self.count('disk_evicted', evicted)
+
+        self.sweeping = asyncio.get_event_loop().run_in_executor(None, self.sweep, time.time())
+        self.sweeping.add_done_callback(done)
+
+    def sweep(self, now):
+        """Remove expired files, then the oldest files while the disk tier is full.
+
+        Other workers write to the same directory, so its usage is measured here.
+        Returns the disk usage and the numbers of expired and evicted files.
+        """
+        files = []
+        usage = 0
+        expired = 0
+        for entry in os.scandir(self.disk_path):
+            try:
+                stat = entry.stat()
+                if self.ttl and stat.st_mtime + self.ttl < now:
+                    os.remove(entry.path)
+                    expired += 1
+                    continue
+            except FileNotFoundError:
+                continue
+            size = disk_usage(stat.st_size)
+            files.append((stat.st_mtime, size, entry.path))
+            usage += size
+        evicted = 0
+        if usage > self.disk_bytes:
+            files.sort()
+            for _, size, path in files:
+                if usage <= self.disk_bytes * DISK_LOW_WATERMARK:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                usage -= size
+                evicted += 1
+        return usage, expired, evicted
+
+    async def get(self, key):
+        """Get a cached item by key."""
+        return (await self.mget([key]))[0]
+
+    async def mget(self, keys):
+        """Get multiple cached items by key, None for misses."""
+        now = time.time()
+        values = [self.memory.get(key, now) for key in keys]
+        missing = [idx for idx, value in enumerate(values) if value is None]
+        self.count('memory_hits', len(keys) - len(missing))
+
+        if missing and self.disk_path is not None:
+            records = await self.disk_read([keys[idx] for idx in missing], now)
+            for idx, data in zip(missing, records):
+                if data is None:
+                    continue
+                values[idx] = self.serializer.loads(data)
+                self.memory.set(keys[idx], values[idx], len(data), self.expiry(now))
+                self.count('disk_hits')
+            missing = [idx for idx in missing if values[idx] is None]
+
+        if missing:
+            records = await self.redis_mget([keys[idx] for idx in missing])
+            hits = dict()
+            for idx, data in zip(missing, records):
+                if data is None:
+                    continue
+                values[idx] = self.serializer.loads(data)
+                self.memory.set(keys[idx], values[idx], len(data), self.expiry(now))
+                hits[keys[idx]] = data
+            self.count('redis_hits', len(hits))
+            if hits and self.disk_path is not None:
+                await self.disk_write(hits)
+            missing = [idx for idx in missing if values[idx] is None]
+
+        if missing and self.legacy_key is not None and CACHE_LEGACY_READ:
+            legacy = await self.legacy_mget([keys[idx] for idx in missing])
+            migrated = dict()
+            for idx, value in zip(missing, legacy):
+                if value is not None:
+                    values[idx] = migrated[keys[idx]] = value
+            self.count('legacy_hits', len(migrated))
+            await self.mset(migrated)
+
+        self.count('misses', sum(value is None for value in values))
+        return values
+
+    async def set(self, key, value):
+        """Add an item to the cache."""
+        await self.mset({key: value})
+
+    async def mset(self, mapping):
+        """Add multiple items to all tiers, skipping None values.
+
+        Within a write buffer, only the in-process tier is written at once.
+        """
+        now = time.time()
+        records = {
+            key: self.serializer.dumps(value)
+            for key, value in mapping.items()
+            if value is not None
+        }
+        for key, data in records.items():
+            self.memory.set(key, mapping[key], len(data), self.expiry(now))
+        buffer = WRITE_BUFFER.get()
+        if buffer is not None:
+            buffer[self].update(records)
+            return
+        await self.write_through(records)
+
+    async def write_through(self, records):
+        """Write serialized values to the disk and Redis tiers."""
+        if not records:
+            return
+        if self.disk_path is not None:
+            await self.disk_write(records)
+        await self.redis_mset(records)
+
+    async def redis_mget(self, keys):
+        """Get serialized values from Redis, None for misses."""
+        if not self.buckets:
+            replies = await self.manager.redis_execute(self, lambda pipe: [
+                pipe.mget([self.redis_key(key) for key in batch])
+                for batch in batches(keys, CACHE_BATCH_SIZE)
+            ])
+            if replies is None:
+                return [None] * len(keys)
+            return [data for reply in replies for data in reply]
+
+        fields = defaultdict(list)
+        for idx, key in enumerate(keys):
+            fields[self.bucket(key)].append(idx)
+        replies = await self.manager.redis_execute(self, lambda pipe: [
+            pipe.hmget(bucket, [keys[idx] for idx in idxs])
+            for bucket, idxs in fields.items()
+        ])
+        records = [None] * len(keys)
+        for idxs, reply in zip(fields.values(), replies or []):
+            for idx, data in zip(idxs, reply):
+                records[idx] = data
+        return records
+
+    async def redis_mset(self, records):
+        """Write serialized values to Redis, with the namespace TTL."""
+        if not self.buckets:
+            def queue(pipe):
+                """Queue one SET per value, or MSETs if values do not expire."""
+                for batch in batches(list(records.items()), CACHE_BATCH_SIZE):
+                    if self.ttl:
+                        for key, data in batch:
+                            pipe.set(self.redis_key(key), data, ex=self.ttl)
+                    else:
+                        pipe.mset({self.redis_key(key): data for key, data in batch})
+            await self.manager.redis_execute(self, queue)
+            return
+
+        fields = defaultdict(dict)
+        for key, data in records.items():
+            fields[self.bucket(key)][key] = data
+
+        def queue(pipe):
+            """Queue one HSET per bucket."""
+            for bucket, mapping in fields.items():
+                pipe.hset(bucket, mapping=mapping)
+                if self.ttl:
+                    pipe.expire(bucket, self.ttl)
+        await self.manager.redis_execute(self, queue)
+
+    async def delete(self, keys):
+        """Remove items from all tiers."""
+        keys = list(keys)
+        for key in keys:
+            self.memory.pop(key)
+        if not keys:
+            return
+        if self.disk_path is not None:
+            await asyncio.get_event_loop().run_in_executor(None, self.remove, keys)
+        if not self.buckets:
+            await self.manager.redis_execute(self, lambda pipe: [
+                pipe.delete(*(self.redis_key(key) for key in batch))
+                for batch in batches(keys, CACHE_BATCH_SIZE)
+            ])
+            return
+        fields = defaultdict(list)
+        for key in keys:
+            fields[self.bucket(key)].append(key)
+        await self.manager.redis_execute(self, lambda pipe: [
+            pipe.hdel(bucket, *bucket_keys)
+            for bucket, bucket_keys in fields.items()
+        ])
+
+    async def clear(self):
+        """Remove all items from all tiers.
+
+        Only bucketed namespaces are cleared in Redis, by deleting their hashes.
+        """
+        self.memory = MemoryTier(self.memory.max_bytes, self.memory.policy)
+        if self.disk_path is not None:
+            await asyncio.get_event_loop().run_in_executor(None, self.remove)
+            self.disk_usage = 0
+        if self.buckets:
+            await self.manager.redis_execute(self, lambda pipe: [
+                pipe.delete(*(f'{self.name}:{bucket}' for bucket in batch))
+                for batch in batches(range(self.buckets), CACHE_BATCH_SIZE)
+            ])
+
+    async def legacy_mget(self, keys):
+        """Get values from pickled top-level keys, None for misses."""
+        legacy_keys = [self.legacy_key.format(key) for key in keys]
+        replies = await self.manager.redis_execute(self, lambda pipe: [
+            pipe.mget(batch)
+            for batch in batches(legacy_keys, CACHE_BATCH_SIZE)
+        ])
+        values = [None] * len(keys)
+        for idx, data in enumerate(data for reply in replies or [] for data in reply):
+            if data is None:
+                continue
+            values[idx] = self.manager.legacy_serializer.loads(data)
+            if self.legacy_value is not None:
+                values[idx] = self.legacy_value(values[idx])
+        return values
+
+    def info(self):
+        """Get namespace configuration, size and statistics."""
+        return {
+            'ttl': self.ttl,
+            'policy': self.memory.policy,
+            'serializer': self.serializer.__class__.__name__,
+            'buckets': self.buckets,
+            'max_bytes': self.memory.max_bytes,
+            'bytes': self.memory.bytes,
+            'entries': len(self.memory),
+            'disk_bytes': self.disk_bytes,
+            'disk_usage': self.disk_usage,
+            **{
+                name.rsplit('.', 1)[-1]: value
+                for name, value in stats.snapshot(f'cache.{self.name}.').items()
+            },
+        }
+
+
+class CacheManager():
+    """Namespaced multi-tier cache, shared by all requests of a process."""
+
+    def __init__(
+            self,
+            namespaces=None,
+            disk_path=CACHE_DISK_PATH,
+    ):
+        """Create cache manager."""
+        if namespaces is None:
+            namespaces = {
+                name: namespace_config(name, config)
+                for name, config in NAMESPACES.items()
+            }
+        self.disk_path = disk_path
+        self.legacy_serializer = PickleCacheSerializer()
+        self.redis = None
+        self.redis_retry_at = 0
+        self.namespaces = {
+            name: Namespace(self, name, **config)
+            for name, config in namespaces.items()
+        }
+
+    def __getitem__(self, name):
+        """Get namespace."""
+        return self.namespaces[name]
+
+    def get_redis(self):
+        """Get Redis client, or None while Redis is unreachable."""
+        if time.monotonic() < self.redis_retry_at:
+            return None
+        if self.redis is None:
+            self.redis = redis.asyncio.StrictRedis(
+                host=CACHE_HOST,
+                port=CACHE_PORT,
+                db=CACHE_DB,
+                password=CACHE_PASSWORD or None,
+            )
+        return self.redis
+
+    async def redis_execute(self, namespace, queue):
+        """Run the commands queued by queue(pipeline) and return their replies.
+
+        Returns None if Redis is unreachable.
+        """
+        client = self.get_redis()
+        if client is None:
+            return None
+        start = time.perf_counter()
+        try:
+            async with client.pipeline(transaction=False) as pipe:
+                queue(pipe)
+                replies = await pipe.execute()
+        except (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError):
+            logger.exception(
+                "Failed to reach redis at %s:%s/%s, retrying in %s seconds",
+                CACHE_HOST, CACHE_PORT, CACHE_DB, CACHE_REDIS_RETRY,
+            )
+            self.redis_retry_at = time.monotonic() + CACHE_REDIS_RETRY
+            return None
+        namespace.count('redis_seconds', time.perf_counter() - start)
+        namespace.count('redis_calls')
+        return replies
+
+    @asynccontextmanager
+    async def write_buffer(self):
+        """Buffer disk and Redis writes until the end of the context.
+
+        Writes are flushed only if the context exits normally; nested
+        contexts share the outermost buffer.
+        """
+        if WRITE_BUFFER.get() is not None:
+            yield
+            return
+        buffer = defaultdict(dict)
+        token = WRITE_BUFFER.set(buffer)
+        try:
+            yield
+        finally:
+            WRITE_BUFFER.reset(token)
+        await asyncio.gather(*(
+            namespace.write_through(records)
+            for namespace, records in buffer.items()
+        ))
+
+    def info(self):
+        """Get configuration, size and statistics of all namespaces."""
+        return {
+            name: namespace.info()
+            for name, namespace in self.namespaces.items()
+        }
+
+
+CACHE = None
+
+
+def get_cache():
+    """Get the cache manager of this process, creating it if necessary."""
+    global CACHE  # pylint: disable=global-statement
+    if CACHE is None:
+        CACHE = CacheManager()
+    return CACHE
@@ -0,0 +1,157 @@
+"""Operation executor.
+
+CPU-bound operations block the event loop of the worker that runs them,
+so that one large /score stalls every other request on that worker.
+The executor can send such operations to a process pool instead.
+"""
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+import inspect
+import logging
+import multiprocessing
+import os
+
+from fastapi import HTTPException
+
+from messenger.shared import stats
+
+logger = logging.getLogger(__name__)
+
+# comma-separated operations to run in the process pool, or "*" for all
+POOL_OPERATIONS = os.environ.get('MESSENGER_POOL_OPERATIONS', 'score')
+POOL_WORKERS = int(os.environ.get('MESSENGER_POOL_WORKERS', '2'))
+# maximum number of messages handed to the pool at once
+POOL_MAX_PENDING = int(os.environ.get('MESSENGER_POOL_MAX_PENDING', '8'))
+# maximum number of messages waiting for the pool; further requests get 503
+POOL_MAX_WAITING = int(os.environ.get('MESSENGER_POOL_MAX_WAITING', '32'))
+
+# whether this process is a pool process, see enter_pool
+IN_POOL = False
+
+
+class Executor():
+    """Run operations inline or in a process pool.
+
+    The pool is created lazily, i.e. in each gunicorn worker after the fork.
+    At most max_pending messages are handed to the pool at once;
+    at most max_waiting further requests wait, without blocking the event
+    loop, and the rest are rejected with 503. Jobs of cancelled requests
+    keep running in the pool, and keep their slot until they are done.
+    If a pool process dies, e.g. killed for running out of memory,
+    the requests it was serving fail with 503 and the pool is replaced.
+    """
+
+    def __init__(
+            self,
+            pool_operations=POOL_OPERATIONS,
+            max_workers=POOL_WORKERS,
+            max_pending=POOL_MAX_PENDING,
+            max_waiting=POOL_MAX_WAITING,
+    ):
+        """Create executor."""
+        self.pool_operations = {
+            operation.strip()
+            for operation in pool_operations.split(',')
+            if operation.strip()
+        }
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.max_waiting = max_waiting
+        self.pool = None
+        self.semaphore = None
+        self.waiting = 0
+
+    def in_pool(self, operation):
+        """Check whether operation runs in the process pool."""
+        return '*' in self.pool_operations or operation in self.pool_operations
+
+    async def run(self, method, message, **kwargs):
+        """Run method on message.
+
+        Coroutine functions are awaited.
+        Other functions are run in the pool if configured, otherwise inline.
+        """
+        if inspect.iscoroutinefunction(method):
+            return await method(message, **kwargs)
+        operation = method.__module__.rsplit('.', 1)[-1]
+        if not self.in_pool(operation):
+            return method(message, **kwargs)
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_pending)
+        if self.semaphore.locked() and self.waiting >= self.max_waiting:
+            stats.increment('executor.rejected')
+            raise HTTPException(status_code=503, detail='Too many requests are waiting, try again later.')
+        self.waiting += 1
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        semaphore = self.semaphore
+        future = None
+        try:
+            pool = self.get_pool()
+            future = asyncio.get_event_loop().run_in_executor(
+                pool,
+                partial(call_and_drain, method, message, kwargs),
+            )
+            # the job keeps its slot until it is done, even if this request is cancelled
+            future.add_done_callback(partial(release_slot, semaphore))
+            result, deltas = await asyncio.shield(future)
+        except BrokenProcessPool:
+            logger.error('A process of the pool died while running %s.', operation)
+            stats.increment('executor.broken')
+            if self.pool is pool:
+                # the other requests on this pool fail too; later ones get a new pool
+                self.pool = None
+                pool.shutdown(wait=False)
+            raise HTTPException(status_code=503, detail=f'Operation "{operation}" failed, try again later.')
+        finally:
+            if future is None:
+                semaphore.release()
+        stats.merge(deltas)
+        return result
+
+    def get_pool(self):
+        """Get the process pool, starting it if necessary."""
+        if self.pool is None:
+            logger.debug('Starting process pool with %d workers...', self.max_workers)
+            self.pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=enter_pool,
+            )
+        return self.pool
+
+    def shutdown(self):
+        """Shut down process pool."""
+        if self.pool is None:
+            return
+        logger.debug('Shutting down process pool...')
+        self.pool.shutdown()
+        self.pool = None
+        self.semaphore = None
+
+
+def release_slot(semaphore, future):
+    """Release the slot of a finished pool job."""
+    semaphore.release()
+    if not future.cancelled():
+        # retrieve the exception of jobs whose request was cancelled
+        future.exception()
+
+
+def enter_pool():
+    """Mark this process as a pool process."""
+    global IN_POOL  # pylint: disable=global-statement
+    IN_POOL = True
+
+
+def call_and_drain(method, message, kwargs):
+    """Call method in pool process, returning its result and statistics."""
+    result = method(message, **kwargs)
+    return result, stats.drain()
+
+
+EXECUTOR = Executor()
@@ -1,17 +1,69 @@
-"""Neo4j lookup utilities."""
+"""Neo4j lookup utilities.
+
+Each worker keeps one interface per database (see get_database), whose
+connection pool is shared by all requests of the worker.
+"""
 from abc import ABC, abstractmethod
+import asyncio
 from copy import deepcopy
 import json
 import logging
+import os
 from urllib.parse import urlparse
 
 import httpx
 from neo4j import GraphDatabase, basic_auth
+from neo4j.exceptions import Neo4jError, ServiceUnavailable
 
 from messenger.shared.util import batches, flatten_semilist
 
 logger = logging.getLogger(__name__)
 
+NEO4J_URL = os.environ.get('NEO4J_URL', 'http://localhost:7474')
+NEO4J_USER = os.environ.get('NEO4J_USER', 'neo4j')
+NEO4J_PASSWORD = os.environ.get('NEO4J_PASSWORD', 'pword')
+# maximum number of open connections per database
+NEO4J_POOL_SIZE = int(os.environ.get('NEO4J_POOL_SIZE', '20'))
+# seconds that idle HTTP connections are kept open
+NEO4J_KEEPALIVE = float(os.environ.get('NEO4J_KEEPALIVE', '60'))
+# seconds that Bolt connections are reused before they are replaced
+NEO4J_CONNECTION_LIFETIME = float(os.environ.get('NEO4J_CONNECTION_LIFETIME', '3600'))
+# seconds to wait for a statement, or empty for no limit
+NEO4J_TIMEOUT = float(os.environ['NEO4J_TIMEOUT']) if os.environ.get('NEO4J_TIMEOUT') else None
+
+DATABASES = dict()
+
+
+def get_database(url=NEO4J_URL, credentials=None):
+    """Get the worker's shared interface to the database at url, creating it if necessary."""
+    if credentials is None:
+        credentials = {
+            'username': NEO4J_USER,
+            'password': NEO4J_PASSWORD,
+        }
+    key = (url, credentials['username'])
+    if key not in DATABASES:
+        DATABASES[key] = Neo4jDatabase(url=url, credentials=credentials)
+    return DATABASES[key]
+
+
+async def startup():
+    """Create the shared interface to NEO4J_URL and check that Neo4j is reachable.
+
+    If Neo4j is unavailable, the interface connects on its first statement instead.
+    """
+    try:
+        await get_database().health_check()
+    except (OSError, httpx.HTTPError, Neo4jError, ServiceUnavailable, ValueError, KeyError):
+        logger.exception('Cannot connect to Neo4j')
+
+
+async def shutdown():
+    """Close the shared interfaces."""
+    while DATABASES:
+        _, database = DATABASES.popitem()
+        await database.close()
+
 
 class Neo4jDatabase():
     """Neo4j database.
@@ -39,18 +91,46 @@ class Neo4jDatabase():
 class Neo4jInterface(ABC):
     """Abstract interface to Neo4j database."""
 
-    def __init__(self, url=None, credentials=None, **kwargs):
+    def __init__(
+            self,
+            url=None,
+            credentials=None,
+            pool_size=NEO4J_POOL_SIZE,
+            timeout=NEO4J_TIMEOUT,
+            **kwargs,
+    ):
         """Initialize."""
         url = urlparse(url)
         self.hostname = url.hostname
         self.port = url.port
         self.auth = (credentials['username'], credentials['password'])
+        self.pool_size = pool_size
+        self.timeout = timeout
 
     @abstractmethod
     def run(self, statement, *args):
         """Run statement."""
         pass
 
+    @abstractmethod
+    async def arun(self, statement, *args):
+        """Run statement without blocking the event loop."""
+        pass
+
+    async def health_check(self):
+        """Check that the database answers.
+
+        Raises if it does not.
+        """
+        result = await self.arun('RETURN 1 AS ok')
+        if result != [{'ok': 1}]:
+            raise ValueError(f'Unexpected health check result {result}')
+
+    @abstractmethod
+    async def close(self):
+        """Close connections."""
+        pass
+
 
 class HttpInterface(Neo4jInterface):
     """HTTP interface to Neo4j database."""
@@ -59,29 +139,34 @@ class HttpInterface(Neo4jInterface):
         """Initialize."""
         super().__init__(**kwargs)
         self.url = f'http://{self.hostname}:{self.port}/db/data/transaction/commit'
+        limits = httpx.Limits(
+            max_connections=self.pool_size,
+            max_keepalive_connections=self.pool_size,
+            keepalive_expiry=NEO4J_KEEPALIVE,
+        )
+        self.client = httpx.AsyncClient(auth=self.auth, timeout=self.timeout, limits=limits)
+        # for the synchronous run()
+        self.sync_client = httpx.Client(auth=self.auth, timeout=self.timeout, limits=limits)
 
     async def arun(self, statement, *args):
         """Run statement."""
-        async with httpx.AsyncClient(timeout=None) as client:
-            response = await client.post(
-                self.url,
-                auth=self.auth,
-                json={"statements": [{"statement": statement}]},
-            )
-        result = response.json()['results'][0]
-        result = [
-            dict(zip(result['columns'], datum['row']))
-            for datum in result['data']
-        ]
-        return result
+        response = await self.client.post(
+            self.url,
+            json={"statements": [{"statement": statement}]},
+        )
+        return self.parse(response)
 
     def run(self, statement, *args):
         """Run statement."""
-        response = httpx.post(
+        response = self.sync_client.post(
             self.url,
-            auth=self.auth,
             json={"statements": [{"statement": statement}]},
         )
+        return self.parse(response)
+
+    @staticmethod
+    def parse(response):
+        """Get rows of statement response."""
         result = response.json()['results'][0]
         result = [
             dict(zip(result['columns'], datum['row']))
@@ -89,6 +174,11 @@ class HttpInterface(Neo4jInterface):
         ]
         return result
 
+    async def close(self):
+        """Close connections."""
+        await self.client.aclose()
+        self.sync_client.close()
+
 
 class BoltInterface(Neo4jInterface):
     """Bolt interface to Neo4j database."""
@@ -99,10 +189,22 @@ class BoltInterface(Neo4jInterface):
         self.url = f'bolt://{self.hostname}:{self.port}'
         self.driver = GraphDatabase.driver(
             self.url,
-            auth=basic_auth(*self.auth)
+            auth=basic_auth(*self.auth),
+            max_connection_pool_size=self.pool_size,
+            max_connection_lifetime=NEO4J_CONNECTION_LIFETIME,
+            keep_alive=True,
+            connection_acquisition_timeout=self.timeout or 60,
         )
 
     def run(self, statement, *args):
         """Run statement."""
         with self.driver.session() as session:
             return [dict(row) for row in session.run(statement)]
+
+    async def arun(self, statement, *args):
+        """Run statement in a thread."""
+        return await asyncio.get_event_loop().run_in_executor(None, self.run, statement)
+
+    async def close(self):
+        """Close connections."""
+        self.driver.close()
@@ -0,0 +1,240 @@
+"""Node Normalization client.
+
+Curies are sent in chunks of at most NN_CHUNK_SIZE curies and
+NN_MAX_URL_LENGTH URL characters, at most NN_CONCURRENCY chunks at once
+per call, on a connection pool shared by all requests of the worker.
+Chunks that still fail after NN_RETRIES retries normalize to their
+input curies.
+
+NN_BACKEND selects where curies are normalized: "remote" (the service at
+NN_URL), "local" (the table at NN_TABLE_PATH, see normalization_table),
+or "local-then-remote" (the service normalizes curies not in the table).
+
+Tests can replace the service with set_client(), e.g. with an
+httpx.AsyncClient(app=stand_in_app), and the table with set_table().
+"""
+import asyncio
+import logging
+import os
+import urllib.parse
+
+import httpx
+
+from messenger.shared.cache_manager import get_cache
+from messenger.shared.normalization_table import NormalizationTable
+
+logger = logging.getLogger(__name__)
+
+NN_URL = os.environ.get("NN_URL", "https://nodenormalization-sri.renci.org/get_normalized_nodes?")
+NN_CHUNK_SIZE = int(os.environ.get('NN_CHUNK_SIZE', '100'))
+# servers commonly reject request lines longer than 8 KB
+NN_MAX_URL_LENGTH = int(os.environ.get('NN_MAX_URL_LENGTH', '4096'))
+NN_CONCURRENCY = int(os.environ.get('NN_CONCURRENCY', '4'))
+NN_RETRIES = int(os.environ.get('NN_RETRIES', '2'))
+NN_TIMEOUT = float(os.environ.get('NN_TIMEOUT', '30'))
+NN_MAX_CONNECTIONS = int(os.environ.get('NN_MAX_CONNECTIONS', '20'))
+NN_BACKEND = os.environ.get('NN_BACKEND', 'remote')
+NN_TABLE_PATH = os.environ.get('NN_TABLE_PATH', 'normalization_table')
+
+CLIENT = None
+TABLE = None
+
+
+def get_client():
+    """Get the shared client, creating it if necessary."""
+    global CLIENT  # pylint: disable=global-statement
+    if CLIENT is None:
+        CLIENT = httpx.AsyncClient(
+            timeout=NN_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=NN_MAX_CONNECTIONS,
+                max_keepalive_connections=NN_MAX_CONNECTIONS,
+            ),
+        )
+    return CLIENT
+
+
+def set_client(client):
+    """Replace the shared client."""
+    global CLIENT  # pylint: disable=global-statement
+    CLIENT = client
+
+
+def get_table():
+    """Get the normalization table, opening it if necessary."""
+    global TABLE  # pylint: disable=global-statement
+    if TABLE is None:
+        TABLE = NormalizationTable(NN_TABLE_PATH)
+    return TABLE
+
+
+def set_table(table):
+    """Replace the normalization table."""
+    global TABLE  # pylint: disable=global-statement
+    TABLE = table
+
+
+async def close():
+    """Close the shared client."""
+    global CLIENT  # pylint: disable=global-statement
+    if CLIENT is None:
+        return
+    client, CLIENT = CLIENT, None
+    await client.aclose()
+
+
+def curie_parameter(curie):
+    """Get query parameter of curie."""
+    return f'curie={urllib.parse.quote(curie)}'
+
+
+def chunks(curies, url=NN_URL, chunk_size=NN_CHUNK_SIZE, max_url_length=NN_MAX_URL_LENGTH):
+    """Split curies into chunks of at most chunk_size curies whose URLs fit in max_url_length.
+
+    Curies too long to fit with others are sent alone.
+    """
+    chunk = []
+    length = len(url)
+    for curie in curies:
+        parameter_length = len(curie_parameter(curie)) + 1
+        if chunk and (len(chunk) == chunk_size or length + parameter_length > max_url_length):
+            yield chunk
+            chunk = []
+            length = len(url)
+        chunk.append(curie)
+        length += parameter_length
+    if chunk:
+        yield chunk
+
+
+async def fetch(curies, url=NN_URL, retries=NN_RETRIES):
+    """Get Node Normalization results for curies.
+
+    Returns a dict mapping curies to results, which are None for
+    curies that the service does not know.
+    Raises httpx.HTTPError if the request still fails after retries.
+    """
+    for attempt in range(retries + 1):
+        try:
+            response = await get_client().get(
+                url + '&'.join(curie_parameter(curie) for curie in curies)
+            )
+            if response.status_code == 404:
+                return {curie: None for curie in curies}
+            response.raise_for_status()
+            return response.json()
+        except (httpx.TransportError, httpx.HTTPStatusError) as err:
+            transient = (
+                isinstance(err, httpx.TransportError) or
+                err.response.status_code >= 500
+            )
+            if not transient or attempt == retries:
+                raise
+            logger.warning('Node Normalization failed (%s), retrying...', err)
+            await asyncio.sleep(0.1 * 2 ** attempt)
+
+
+async def lookup(curies, url=NN_URL, chunk_size=NN_CHUNK_SIZE, concurrency=NN_CONCURRENCY):
+    """Get preferred curies from the service.
+
+    Returns a dict mapping curies to their preferred curies, or to None if the
+    service does not know them. Curies of failed chunks are left out.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def lookup_chunk(chunk):
+        """Look up chunk of curies."""
+        async with semaphore:
+            try:
+                results = await fetch(chunk, url)
+            except (httpx.HTTPError, ValueError) as err:
+                logger.error('Failed to normalize %d curies: %s', len(chunk), err)
+                return dict()
+        return {
+            curie: results[curie]['id']['identifier']
+            if results.get(curie) else
+            None
+            for curie in chunk
+        }
+
+    preferred = dict()
+    for chunk_map in await asyncio.gather(*(
+            lookup_chunk(chunk)
+            for chunk in chunks(curies, url, chunk_size)
+    )):
+        preferred.update(chunk_map)
+    return preferred
+
+
+async def normalize(
+        curies,
+        url=NN_URL,
+        chunk_size=NN_CHUNK_SIZE,
+        concurrency=NN_CONCURRENCY,
+        backend=NN_BACKEND,
+):
+    """Map curies to their preferred curies.
+
+    Curies that are not found, or that are in failed chunks, map to themselves.
+    """
+    curies = list(curies)
+    if backend not in ('remote', 'local', 'local-then-remote'):
+        raise ValueError(f'Unknown normalization backend "{backend}"')
+    if backend == 'remote':
+        return await normalize_remote(curies, url, chunk_size, concurrency)
+    preferred = get_table().lookup(curies)
+    curie_map = {
+        curie: value
+        for curie, value in preferred.items()
+        if value is not None
+    }
+    misses = [curie for curie in curies if curie not in curie_map]
+    if backend == 'local-then-remote':
+        curie_map.update(await normalize_remote(misses, url, chunk_size, concurrency))
+    else:
+        curie_map.update({curie: curie for curie in misses})
+    return curie_map
+
+
+async def normalize_remote(curies, url=NN_URL, chunk_size=NN_CHUNK_SIZE, concurrency=NN_CONCURRENCY):
+    """Map curies to their preferred curies with the service.
+
+    Results, including curies that the service does not know, are cached
+    in the normalization namespace of the process cache (see cache_manager),
+    and only cache misses are looked up.
+    """
+    if not curies:
+        return dict()
+    cache = get_cache()['normalization']
+    # cached values are preferred curies, or '' for unknown curies
+    values = await cache.mget(curies)
+    curie_map = {
+        curie: value or curie
+        for curie, value in zip(curies, values)
+        if value is not None
+    }
+    misses = [curie for curie, value in zip(curies, values) if value is None]
+    if misses:
+        preferred = await lookup(misses, url, chunk_size, concurrency)
+        await cache.mset({
+            curie: value or ''
+            for curie, value in preferred.items()
+        })
+        curie_map.update({
+            curie: preferred.get(curie) or curie
+            for curie in misses
+        })
+    return curie_map
+
+
+async def invalidate(curies=None):
+    """Remove curies, or all curies, from the normalization cache.
+
+    This worker's in-process tier and the shared tiers are cleared;
+    other workers keep their in-process entries until they expire.
+    """
+    cache = get_cache()['normalization']
+    if curies is None:
+        await cache.clear()
+    else:
+        await cache.delete(curies)
@@ -0,0 +1,140 @@
+"""Memory-mapped curie normalization table.
+
+The table is a directory of two arrays:
+
+* curies.npy: sorted curies (bytes),
+* preferred.npy: preferred[i] is the index of the preferred curie of curies[i].
+
+Like an Omnicorp index (see omnicorp_index), the table is shared by all
+workers on a host.
+
+Build a table from synonym dumps:
+    python -m messenger.shared.normalization_table TABLE_PATH compendium.txt ...
+Dumps are either Node Normalization compendia, i.e. JSON lines with
+"identifiers": [{"i": curie}, ...] listing the preferred curie first,
+or tab-separated lines of curie and preferred curie.
+"""
+import argparse
+from itertools import islice
+import json
+import logging
+import os
+
+import numpy as np
+
+from messenger.shared.util import sorted_lookup
+
+logger = logging.getLogger(__name__)
+
+FILES = ('curies', 'preferred')
+# synonyms converted to arrays at once
+CHUNK_ROWS = 1000000
+
+
+def read_synonyms(path):
+    """Iterate over (curie, preferred curie) pairs of a synonym dump."""
+    with open(path) as stream:
+        for line in stream:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('{'):
+                identifiers = [identifier['i'] for identifier in json.loads(line)['identifiers']]
+                for curie in identifiers:
+                    yield curie, identifiers[0]
+            else:
+                curie, preferred = line.split('\t')[:2]
+                yield curie, preferred
+
+
+def read_dumps(dump_paths):
+    """Iterate over (curie, preferred curie) pairs of synonym dumps."""
+    for dump_path in dump_paths:
+        logger.info('Reading %s...', dump_path)
+        yield from read_synonyms(dump_path)
+
+
+def first_synonyms(curies, preferred):
+    """Get sorted unique curies and the preferred curie of their first row."""
+    curies, first = np.unique(curies, return_index=True)
+    return curies, preferred[first]
+
+
+def build_table(path, dump_paths, chunk_rows=CHUNK_ROWS):
+    """Build table at path from synonym dumps.
+
+    Synonyms are read in chunks straight into arrays, and each preferred
+    curie is its own synonym unless listed otherwise. If a curie is
+    listed more than once, its first preferred curie wins. Chains of
+    preferred curies are followed to their end.
+    """
+    synonyms = read_dumps(dump_paths)
+    chunks = []
+    while True:
+        rows = list(islice(synonyms, chunk_rows))
+        if not rows:
+            break
+        # each row lists its curie, then its preferred curie as its own synonym
+        curies = np.array([curie.encode() for row in rows for curie in row])
+        preferred = np.array([preferred.encode() for _, preferred in rows]).repeat(2)
+        del rows
+        chunks.append(first_synonyms(curies, preferred))
+    if not chunks:
+        curies, preferred = np.zeros(0, dtype='S1'), np.zeros(0, dtype=np.int64)
+    else:
+        # chunks are in order, so the first row of each curie still wins
+        curies, preferred = first_synonyms(
+            np.concatenate([curies for curies, _ in chunks]),
+            np.concatenate([preferred for _, preferred in chunks]),
+        )
+        del chunks
+        preferred = np.searchsorted(curies, preferred).astype(np.int64)
+    # preferred curies are listed before their synonyms, or are their own, so chains end
+    while True:
+        resolved = preferred[preferred]
+        if np.array_equal(resolved, preferred):
+            break
+        preferred = resolved
+
+    os.makedirs(path, exist_ok=True)
+    for name, array in zip(FILES, (curies, preferred)):
+        np.save(os.path.join(path, f'{name}.npy'), array)
+    logger.info('Indexed %d curies.', len(curies))
+
+
+class NormalizationTable():
+    """Curie normalization from a memory-mapped table."""
+
+    def __init__(self, path):
+        """Open table."""
+        self.curies, self.preferred = (
+            np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r')
+            for name in FILES
+        )
+
+    def lookup(self, curies):
+        """Get preferred curies.
+
+        Returns a dict mapping curies to their preferred curies, or to None
+        if they are not in the table.
+        """
+        curies = list(curies)
+        idx = sorted_lookup(self.curies, curies).tolist()
+        return {
+            curie: self.curies[self.preferred[i]].decode() if i >= 0 else None
+            for curie, i in zip(curies, idx)
+        }
+
+
+def main():
+    """Build table."""
+    parser = argparse.ArgumentParser(description='Build a memory-mapped curie normalization table.')
+    parser.add_argument('path', help='table directory')
+    parser.add_argument('dump_paths', nargs='+', metavar='dump', help='synonym dump')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    build_table(args.path, args.dump_paths)
+
+
+if __name__ == '__main__':
+    main()
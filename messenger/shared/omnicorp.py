@@ -1,27 +1,81 @@
 """Omnicorp support module."""
+from contextlib import ExitStack
 import logging
+import os
+
+from .omnicorp_index import OmnicorpIndex
 from .omnicorp_postgres import OmniCorp
+from .omnicorp_sketch import OmnicorpSketches
+from .scheduler import request_scope
 
 logger = logging.getLogger(__name__)
 
 COUNT_KEY = 'omnicorp_article_count'
+# "postgres" or "index"
+OMNICORP_BACKEND = os.environ.get('OMNICORP_BACKEND', 'postgres')
+OMNICORP_INDEX_PATH = os.environ.get('OMNICORP_INDEX_PATH', 'omnicorp_index')
+# index directory with sketches.npy, see omnicorp_sketch
+OMNICORP_SKETCH_PATH = os.environ.get('OMNICORP_SKETCH_PATH', OMNICORP_INDEX_PATH)
+
+INDEX = None
+SKETCHES = None
+
+
+def get_index():
+    """Get the Omnicorp index of this process, opening it if necessary."""
+    global INDEX  # pylint: disable=global-statement
+    if INDEX is None:
+        INDEX = OmnicorpIndex(OMNICORP_INDEX_PATH)
+    return INDEX
+
+
+def get_sketches():
+    """Get the Omnicorp sketches of this process, opening them if necessary.
+
+    Returns None if there are no sketches at OMNICORP_SKETCH_PATH.
+    """
+    global SKETCHES  # pylint: disable=global-statement
+    if SKETCHES is None:
+        try:
+            SKETCHES = OmnicorpSketches(OMNICORP_SKETCH_PATH)
+        except FileNotFoundError:
+            return None
+    return SKETCHES
 
 
 class OmnicorpSupport():
     """Omnicorp support object."""
 
-    def __init__(self):
-        """Create omnicorp support object."""
-        self.omnicorp = OmniCorp()
+    def __init__(self, backend=OMNICORP_BACKEND):
+        """Create omnicorp support object.
+
+        Counts come from PostgreSQL or from the memory-mapped index
+        at OMNICORP_INDEX_PATH (see omnicorp_index).
+        """
+        self.scope = None
+        if backend == 'index':
+            self.omnicorp = get_index()
+        elif backend == 'postgres':
+            self.omnicorp = OmniCorp()
+        else:
+            raise ValueError(f'Unknown Omnicorp backend "{backend}"')
 
     async def __aenter__(self):
-        """Enter context."""
+        """Enter context.
+
+        Until exit, database jobs are limited to the concurrency of one request.
+        """
         await self.omnicorp.connect()
+        self.scope = ExitStack()
+        self.scope.enter_context(request_scope())
         return self
 
     async def __aexit__(self, exception_type, exception_value, traceback):
         """Exit context, closing database connection."""
-        await self.omnicorp.close()
+        try:
+            await self.omnicorp.close()
+        finally:
+            self.scope.close()
 
     def term_to_term_pmids(self, node_a, node_b):
         """Get number of articles related to both terms and return the result."""
@@ -33,6 +87,24 @@ class OmnicorpSupport():
         num_articles = await self.omnicorp.get_shared_pmids_count(node_a, node_b)
         return num_articles
 
+    async def term_to_term_pmid_count_many(self, pairs):
+        """Get numbers of articles related to both terms, for many pairs of terms.
+
+        Returns a dict mapping each pair to its count.
+        """
+        return await self.omnicorp.get_shared_pmids_count_many(pairs)
+
+    def can_estimate(self):
+        """Check whether counts can be estimated, i.e. sketches are available."""
+        return get_sketches() is not None
+
+    async def term_to_term_pmid_count_estimates(self, pairs):
+        """Estimate numbers of articles related to both terms, for many pairs of terms.
+
+        Returns a dict mapping each pair to its estimated count.
+        """
+        return get_sketches().estimate_shared_pmids_count_many(pairs)
+
     def node_pmids(self, node):
         """Get node publications."""
         pmids = self.omnicorp.get_pmids(node)
@@ -42,3 +114,14 @@ class OmnicorpSupport():
         """Get node publication count."""
         count = await self.omnicorp.count_pmids(node)
         return {COUNT_KEY: count}
+
+    async def node_pmid_count_many(self, nodes):
+        """Get node publication counts for many nodes.
+
+        Returns a dict mapping each node to its count dict.
+        """
+        counts = await self.omnicorp.count_pmids_many(nodes)
+        return {
+            node: {COUNT_KEY: count}
+            for node, count in counts.items()
+        }
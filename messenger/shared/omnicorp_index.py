@@ -0,0 +1,231 @@
+"""Memory-mapped Omnicorp index.
+
+The index is a directory of three arrays:
+
+* curies.npy: sorted curies (bytes),
+* offsets.npy: the PMIDs of curies[i] are pmids[offsets[i]:offsets[i + 1]],
+* pmids.npy: sorted PMIDs of each curie, concatenated.
+
+The arrays are memory-mapped read-only, so all workers on a host share
+one copy through the page cache.
+
+Build an index from Omnicorp CSV dumps (curie,pubmedid with a header):
+    python -m messenger.shared.omnicorp_index INDEX_PATH omnicorp_mondo.csv ...
+"""
+import argparse
+import asyncio
+import csv
+from itertools import islice
+import logging
+import os
+
+import numpy as np
+
+from messenger.shared import scheduler
+from messenger.shared.util import batches, sorted_lookup
+
+logger = logging.getLogger(__name__)
+
+FILES = ('curies', 'offsets', 'pmids')
+# CSV rows converted to arrays at once
+CHUNK_ROWS = 1000000
+# pairs or curies counted per job
+OMNICORP_CHUNK_SIZE = int(os.environ.get('OMNICORP_CHUNK_SIZE', '5000'))
+
+
+def sort_rows(codes, pmids):
+    """Sort rows by curie code, then PMID, and drop duplicate rows."""
+    order = np.lexsort((pmids, codes))
+    codes, pmids = codes[order], pmids[order]
+    keep = np.ones(len(codes), dtype=bool)
+    keep[1:] = (codes[1:] != codes[:-1]) | (pmids[1:] != pmids[:-1])
+    return codes[keep], pmids[keep]
+
+
+def read_csv(csv_path, chunk_rows=CHUNK_ROWS):
+    """Read Omnicorp CSV file.
+
+    Rows are read in chunks straight into arrays. Returns the sorted,
+    unique curies and, per unique row, the curie code (index into the
+    curies) and PMID, sorted by curie and PMID.
+    """
+    chunks = []
+    with open(csv_path, newline='') as stream:
+        reader = csv.reader(stream)
+        next(reader)
+        while True:
+            rows = list(islice(reader, chunk_rows))
+            if not rows:
+                break
+            curies, pmids = zip(*rows)
+            del rows
+            unique_curies, codes = np.unique(
+                np.array([curie.encode() for curie in curies]),
+                return_inverse=True,
+            )
+            chunks.append((unique_curies, codes.ravel(), np.array(pmids).astype(np.int32)))
+    if not chunks:
+        return np.zeros(0, dtype='S1'), np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32)
+    curies = np.unique(np.concatenate([unique_curies for unique_curies, _, _ in chunks]))
+    codes = np.concatenate([
+        np.searchsorted(curies, unique_curies).astype(np.int32)[codes]
+        for unique_curies, codes, _ in chunks
+    ])
+    pmids = np.concatenate([pmids for _, _, pmids in chunks])
+    del chunks
+    return (curies, *sort_rows(codes, pmids))
+
+
+def build_index(path, csv_paths, chunk_rows=CHUNK_ROWS):
+    """Build index at path from Omnicorp CSV files.
+
+    Each file is sorted on its own. Omnicorp has one file per curie
+    prefix, so files usually do not share curies and their rows only
+    need to be merged, not sorted again.
+    """
+    files = []
+    for csv_path in csv_paths:
+        logger.info('Reading %s...', csv_path)
+        files.append(read_csv(csv_path, chunk_rows))
+    unique_curies = np.unique(np.concatenate([curies for curies, _, _ in files]))
+    disjoint = sum(len(curies) for curies, _, _ in files) == len(unique_curies)
+    codes = np.concatenate([
+        np.searchsorted(unique_curies, curies).astype(np.int32)[codes]
+        for curies, codes, _ in files
+    ])
+    pmids = np.concatenate([pmids for _, _, pmids in files])
+    del files
+    if disjoint:
+        # the rows of each curie come from one file, sorted and unique
+        order = np.argsort(codes, kind='stable')
+        codes, pmids = codes[order], pmids[order]
+    else:
+        codes, pmids = sort_rows(codes, pmids)
+
+    offsets = np.zeros(len(unique_curies) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(codes, minlength=len(unique_curies)), out=offsets[1:])
+
+    os.makedirs(path, exist_ok=True)
+    for name, array in zip(FILES, (unique_curies, offsets, pmids)):
+        np.save(os.path.join(path, f'{name}.npy'), array)
+    logger.info('Indexed %d PMIDs of %d curies.', len(pmids), len(unique_curies))
+
+
+def intersection_size(a, b):
+    """Count common elements of two sorted arrays of unique elements."""
+    if len(a) > len(b):
+        a, b = b, a
+    if not len(a):
+        return 0
+    idx = np.searchsorted(b, a)
+    idx[idx == len(b)] = 0
+    return int(np.count_nonzero(b[idx] == a))
+
+
+class OmnicorpIndex():
+    """Omnicorp counts from a memory-mapped index.
+
+    Implements the counting methods of omnicorp_postgres.OmniCorp.
+    """
+
+    def __init__(self, path):
+        """Open index."""
+        self.curies, self.offsets, self.pmids = (
+            np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r')
+            for name in FILES
+        )
+
+    async def connect(self):
+        """Do nothing; the index is already open."""
+
+    async def close(self):
+        """Do nothing; the index stays open for other requests."""
+
+    def lookup(self, nodes):
+        """Get index of each curie, or -1 for curies not in the index."""
+        return sorted_lookup(self.curies, nodes)
+
+    def pmids_of(self, idx):
+        """Get sorted PMIDs of curie index."""
+        if idx < 0:
+            return self.pmids[:0]
+        return self.pmids[self.offsets[idx]:self.offsets[idx + 1]]
+
+    async def get_shared_pmids_count(self, node1, node2):
+        """Get shared PMIDs count."""
+        return (await self.get_shared_pmids_count_many([(node1, node2)]))[(node1, node2)]
+
+    async def get_shared_pmids_count_many(self, pairs):
+        """Get shared PMID counts for many pairs of curies.
+
+        Pairs are counted in chunks of OMNICORP_CHUNK_SIZE, each in a
+        thread, in slots of the scheduler.
+        Returns a dict mapping each pair to its count.
+        """
+        results = await scheduler.SCHEDULER.gather((
+            self.run_in_thread(self.count_shared_pmids_chunk, chunk)
+            for chunk in batches(list(pairs), OMNICORP_CHUNK_SIZE)
+        ), priority=scheduler.PAIRS)
+        counts = dict()
+        for result in results:
+            counts.update(result)
+        return counts
+
+    def count_shared_pmids_chunk(self, pairs):
+        """Get shared PMID counts for pairs of curies."""
+        nodes = list({node for pair in pairs for node in pair})
+        index = dict(zip(nodes, self.lookup(nodes).tolist()))
+        counts = dict()
+        for pair in pairs:
+            idx1, idx2 = index[pair[0]], index[pair[1]]
+            if idx1 < 0 or idx2 < 0:
+                counts[pair] = 0
+                continue
+            counts[pair] = intersection_size(self.pmids_of(idx1), self.pmids_of(idx2))
+        return counts
+
+    async def count_pmids(self, node):
+        """Count PMIDs of curie."""
+        return (await self.count_pmids_many([node]))[node]
+
+    async def count_pmids_many(self, nodes):
+        """Count PMIDs of many curies.
+
+        Curies are counted in chunks of OMNICORP_CHUNK_SIZE, like pairs.
+        Returns a dict mapping each curie to its count.
+        """
+        results = await scheduler.SCHEDULER.gather((
+            self.run_in_thread(self.count_pmids_chunk, chunk)
+            for chunk in batches(list(nodes), OMNICORP_CHUNK_SIZE)
+        ), priority=scheduler.NODES)
+        counts = dict()
+        for result in results:
+            counts.update(result)
+        return counts
+
+    def count_pmids_chunk(self, nodes):
+        """Count PMIDs of curies."""
+        idx = self.lookup(nodes)
+        found = idx >= 0
+        sizes = np.zeros(len(nodes), dtype=np.int64)
+        sizes[found] = self.offsets[idx[found] + 1] - self.offsets[idx[found]]
+        return dict(zip(nodes, sizes.tolist()))
+
+    @staticmethod
+    async def run_in_thread(method, chunk):
+        """Run method on chunk in a thread, off the event loop."""
+        return await asyncio.get_event_loop().run_in_executor(None, method, chunk)
+
+
+def main():
+    """Build index."""
+    parser = argparse.ArgumentParser(description='Build a memory-mapped Omnicorp index.')
+    parser.add_argument('path', help='index directory')
+    parser.add_argument('csv_paths', nargs='+', metavar='csv', help='Omnicorp CSV file (curie,pubmedid)')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    build_index(args.path, args.csv_paths)
+
+
+if __name__ == '__main__':
+    main()
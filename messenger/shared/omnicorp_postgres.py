@@ -1,9 +1,12 @@
 """Omnicorp service module."""
+import asyncio
+from collections import defaultdict
 import datetime
 import os
 import logging
 import asyncpg
-from messenger.shared.util import get_curie_prefix
+from messenger.shared import scheduler
+from messenger.shared.util import batches, get_curie_prefix
 
 logger = logging.getLogger(__name__)
 
@@ -13,6 +16,64 @@ OMNICORP_USER = os.environ.get('OMNICORP_USER', 'murphy')
 OMNICORP_PORT = os.environ.get('OMNICORP_PORT', '5432')
 OMNICORP_HOST = os.environ.get('OMNICORP_HOST', 'localhost')
 OMNICORP_PASSWORD = os.environ.get('OMNICORP_PASSWORD', 'pword')
+# maximum number of curies or pairs sent with one statement
+OMNICORP_CHUNK_SIZE = int(os.environ.get('OMNICORP_CHUNK_SIZE', '5000'))
+OMNICORP_POOL_MIN_SIZE = int(os.environ.get('OMNICORP_POOL_MIN_SIZE', '2'))
+OMNICORP_POOL_MAX_SIZE = int(os.environ.get('OMNICORP_POOL_MAX_SIZE', '10'))
+# prepared statements kept per connection
+# there is one count statement per prefix and one per pair of prefixes
+OMNICORP_STATEMENT_CACHE_SIZE = int(os.environ.get('OMNICORP_STATEMENT_CACHE_SIZE', '1024'))
+
+POOL = None
+
+
+async def create_pool():
+    """Create PostgreSQL connection pool."""
+    logger.debug("Creating PostgreSQL connection pool...")
+    return await asyncpg.create_pool(
+        user=OMNICORP_USER,
+        password=OMNICORP_PASSWORD,
+        database=OMNICORP_DB,
+        host=OMNICORP_HOST,
+        port=OMNICORP_PORT,
+        min_size=OMNICORP_POOL_MIN_SIZE,
+        max_size=OMNICORP_POOL_MAX_SIZE,
+        statement_cache_size=OMNICORP_STATEMENT_CACHE_SIZE,
+    )
+
+
+async def get_pool():
+    """Get the worker's shared connection pool, creating it if necessary."""
+    global POOL
+    if POOL is None:
+        pool = await create_pool()
+        if POOL is None:
+            POOL = pool
+        else:
+            # another request created the pool while we were connecting
+            await pool.close()
+    return POOL
+
+
+async def startup():
+    """Create the shared connection pool.
+
+    If PostgreSQL is unavailable, the pool is created by the first request instead.
+    """
+    try:
+        await get_pool()
+    except (OSError, asyncio.TimeoutError, asyncpg.PostgresError):
+        logger.exception('Cannot connect to PostgreSQL')
+
+
+async def shutdown():
+    """Close the shared connection pool."""
+    global POOL
+    if POOL is None:
+        return
+    logger.debug('Closing PostgreSQL connection pool...')
+    pool, POOL = POOL, None
+    await pool.close()
 
 
 class OmniCorp():
@@ -42,20 +103,15 @@ class OmniCorp():
         self.total_pair_call = datetime.timedelta()
 
     async def connect(self):
-        """Connect to PostgreSQL."""
-        logger.debug("Creating PostgreSQL connection pool...")
-        self.pool = await asyncpg.create_pool(
-            user=OMNICORP_USER,
-            password=OMNICORP_PASSWORD,
-            database=OMNICORP_DB,
-            host=OMNICORP_HOST,
-            port=OMNICORP_PORT,
-        )
+        """Connect to PostgreSQL, borrowing the shared connection pool."""
+        self.pool = await get_pool()
 
     async def close(self):
-        """Close PostgreSQL connection."""
-        logger.debug('Closing PostgreSQL connection pool...')
-        await self.pool.close()
+        """Release PostgreSQL connection pool.
+
+        The shared pool stays open until shutdown().
+        """
+        self.pool = None
 
     async def get_shared_pmids_count(self, node1, node2):
         """Get shared PMIDs."""
@@ -81,6 +137,89 @@ class OmniCorp():
             return None
         return pmid_count
 
+    async def get_shared_pmids_count_many(self, pairs):
+        """Get shared PMID counts for many pairs of curies.
+
+        Pairs are grouped by the tables of their prefixes, and each group
+        is counted with one set-based statement per OMNICORP_CHUNK_SIZE pairs.
+        Returns a dict mapping each pair to its count.
+        """
+        counts = dict()
+        groups = defaultdict(list)
+        for pair in pairs:
+            prefixes = tuple(get_curie_prefix(node) for node in pair)
+            if any(prefix not in self.prefixes for prefix in prefixes):
+                counts[pair] = 0
+                continue
+            groups[prefixes].append(pair)
+        results = await scheduler.SCHEDULER.gather((
+            self.count_shared_pmids_chunk(prefix1, prefix2, chunk)
+            for (prefix1, prefix2), group in groups.items()
+            for chunk in batches(group, OMNICORP_CHUNK_SIZE)
+        ), priority=scheduler.PAIRS)
+        for result in results:
+            counts.update(result)
+        return counts
+
+    async def count_shared_pmids_chunk(self, prefix1, prefix2, pairs):
+        """Get shared PMID counts for pairs with the same prefixes."""
+        statement = (
+            "SELECT p.curie1, p.curie2, COUNT(a.pubmedid)\n"
+            "FROM unnest($1::text[], $2::text[]) AS p(curie1, curie2)\n"
+            f"JOIN omnicorp.{prefix1} a ON a.curie = p.curie1\n"
+            f"JOIN omnicorp.{prefix2} b ON b.curie = p.curie2 AND b.pubmedid = a.pubmedid\n"
+            "GROUP BY p.curie1, p.curie2"
+        )
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch(
+                statement,
+                [pair[0] for pair in pairs],
+                [pair[1] for pair in pairs],
+            )
+        counts = {pair: 0 for pair in pairs}
+        counts.update({
+            (row['curie1'], row['curie2']): row['count']
+            for row in rows
+        })
+        return counts
+
+    async def count_pmids_many(self, nodes):
+        """Count PMIDs of many curies.
+
+        Curies are grouped by prefix, and each prefix table is queried
+        with one grouped statement per OMNICORP_CHUNK_SIZE curies.
+        Returns a dict mapping each curie to its count.
+        """
+        counts = dict()
+        groups = defaultdict(list)
+        for node in nodes:
+            prefix = get_curie_prefix(node)
+            if prefix not in self.prefixes:
+                counts[node] = 0
+                continue
+            groups[prefix].append(node)
+        results = await scheduler.SCHEDULER.gather((
+            self.count_pmids_chunk(prefix, chunk)
+            for prefix, group in groups.items()
+            for chunk in batches(group, OMNICORP_CHUNK_SIZE)
+        ), priority=scheduler.NODES)
+        for result in results:
+            counts.update(result)
+        return counts
+
+    async def count_pmids_chunk(self, prefix, nodes):
+        """Count PMIDs of curies with the same prefix."""
+        statement = (
+            f"SELECT curie, COUNT(pubmedid) from omnicorp.{prefix}\n"
+            "WHERE curie = ANY($1::text[])\n"
+            "GROUP BY curie"
+        )
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch(statement, nodes)
+        counts = {node: 0 for node in nodes}
+        counts.update({row['curie']: row['count'] for row in rows})
+        return counts
+
     async def count_pmids(self, node):
         """Count PMIDs and return result."""
         if get_curie_prefix(node) not in self.prefixes:
@@ -0,0 +1,121 @@
+"""Bottom-k MinHash sketches of Omnicorp PMIDs.
+
+The sketch of a curie holds the k smallest hashes of its PMIDs.
+Shared PMID counts estimated from two sketches are exact if both curies
+have at most k PMIDs; otherwise their relative standard error is
+about 1/sqrt(k * jaccard similarity) or less.
+
+Sketches are stored next to an Omnicorp index (see omnicorp_index) and
+are built from it:
+    python -m messenger.shared.omnicorp_sketch INDEX_PATH --size 128
+"""
+import argparse
+import logging
+import os
+
+import numpy as np
+
+from messenger.shared.omnicorp_index import OmnicorpIndex
+from messenger.shared.util import batches
+
+logger = logging.getLogger(__name__)
+
+# padding of sketches of curies with fewer than k PMIDs
+EMPTY = np.iinfo(np.uint32).max
+# number of pairs estimated at once
+BATCH_SIZE = 10000
+
+
+def hash_pmids(pmids):
+    """Hash PMIDs to uint32 values below EMPTY (splitmix64 finalizer)."""
+    x = np.asarray(pmids, dtype=np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    x = x ^ (x >> np.uint64(31))
+    return (x >> np.uint64(32)).astype(np.uint32) % EMPTY
+
+
+def build_sketches(path, size=128):
+    """Build sketches of the curies of the index at path."""
+    index = OmnicorpIndex(path)
+    sketches = np.lib.format.open_memmap(
+        os.path.join(path, 'sketches.npy'),
+        mode='w+',
+        dtype=np.uint32,
+        shape=(len(index.curies), size),
+    )
+    sketches[:] = EMPTY
+    for idx in range(len(index.curies)):
+        hashes = np.unique(hash_pmids(index.pmids_of(idx)))
+        sketches[idx, :min(size, len(hashes))] = hashes[:size]
+    sketches.flush()
+    logger.info('Sketched %d curies.', len(index.curies))
+
+
+def estimate_intersections(sketches1, sizes1, sketches2, sizes2):
+    """Estimate intersection sizes of pairs of sets from their sketches.
+
+    sketches1[i] and sketches2[i] are the sketches of the i-th pair of sets,
+    and sizes1[i] and sizes2[i] their exact sizes.
+    """
+    merged = np.sort(np.concatenate([sketches1, sketches2], axis=1), axis=1)
+    # all hashes of either set up to the smaller of the largest hashes
+    # of the two sketches are known
+    threshold = np.minimum(sketches1[:, -1], sketches2[:, -1])
+    known = (merged <= threshold[:, np.newaxis]) & (merged != EMPTY)
+    first = np.ones(merged.shape, dtype=bool)
+    first[:, 1:] = merged[:, 1:] != merged[:, :-1]
+    union = np.sum(first & known, axis=1)
+    # repeated hashes are in both sketches
+    shared = np.sum(~first & known, axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        jaccard = np.where(union > 0, shared / union, 0.0)
+    return np.rint(jaccard / (1 + jaccard) * (sizes1 + sizes2)).astype(np.int64)
+
+
+class OmnicorpSketches(OmnicorpIndex):
+    """Omnicorp index with PMID sketches."""
+
+    def __init__(self, path):
+        """Open index and sketches."""
+        super().__init__(path)
+        self.sketches = np.load(os.path.join(path, 'sketches.npy'), mmap_mode='r')
+
+    def estimate_shared_pmids_count_many(self, pairs):
+        """Estimate shared PMID counts for many pairs of curies.
+
+        Returns a dict mapping each pair to its estimated count.
+        """
+        pairs = list(pairs)
+        nodes = list({node for pair in pairs for node in pair})
+        index = dict(zip(nodes, self.lookup(nodes).tolist()))
+        counts = dict()
+        for batch in batches(pairs, BATCH_SIZE):
+            idx = np.array([[index[node1], index[node2]] for node1, node2 in batch], dtype=np.int64)
+            idx = idx.reshape(-1, 2)
+            found = np.all(idx >= 0, axis=1)
+            estimates = np.zeros(len(batch), dtype=np.int64)
+            idx1, idx2 = idx[found, 0], idx[found, 1]
+            if found.any():
+                estimates[found] = estimate_intersections(
+                    self.sketches[idx1],
+                    self.offsets[idx1 + 1] - self.offsets[idx1],
+                    self.sketches[idx2],
+                    self.offsets[idx2 + 1] - self.offsets[idx2],
+                )
+            counts.update(zip(batch, estimates.tolist()))
+        return counts
+
+
+def main():
+    """Build sketches."""
+    parser = argparse.ArgumentParser(description='Build MinHash sketches of an Omnicorp index.')
+    parser.add_argument('path', help='index directory (see omnicorp_index)')
+    parser.add_argument('--size', type=int, default=128, help='hashes per curie')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    build_sketches(args.path, args.size)
+
+
+if __name__ == '__main__':
+    main()
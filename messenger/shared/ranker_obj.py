@@ -2,21 +2,44 @@
 
 from operator import itemgetter
 from collections import defaultdict
+import hashlib
+import heapq
 from itertools import combinations, permutations, product
 import logging
+import os
 import re
 from uuid import uuid4
 import numpy as np
-from messenger.shared.util import flatten_semilist
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+from scipy.sparse.linalg import splu
+from messenger.shared import stats
+from messenger.shared.util import batches, flatten_semilist
 
 logger = logging.getLogger(__name__)
 
+# maximum number of Laplacian entries solved in one batch
+BATCH_ELEMENTS = 2 ** 22
+# rgraphs with more nodes than this are scored with sparse matrices
+SPARSE_THRESHOLD = int(os.environ.get('RANKER_SPARSE_THRESHOLD', '500'))
+
 
 class Ranker:
     """Ranker."""
 
-    def __init__(self, message):
-        """Create ranker."""
+    def __init__(self, message, sparse_threshold=SPARSE_THRESHOLD, estimator=None, cache=None):
+        """Create ranker.
+
+        If an estimator is given, it is used for answers with more
+        non-set nodes than estimator probes, and each answer gets a
+        score_error.
+
+        If a cache (see score_cache.ScoreCache) is given, exact scores are
+        looked up in and added to it, keyed by their canonical rgraph.
+        """
+        self.sparse_threshold = sparse_threshold
+        self.estimator = estimator
+        self.cache = cache
         kgraph = message['knowledge_graph']
         qgraph = message['query_graph']
 
@@ -37,85 +60,309 @@ class Ranker:
         for edge in qgraph['edges']:
             degree[edge['source_id']] += 1
             degree[edge['target_id']] += 1
-        self.leaf_sets = [
+        self.leaf_sets = {
             node['id']
             for node in qgraph['nodes']
             if node.get('set', False) and degree[node['id']]==1
-        ]
+        }
 
 
     def rank(self, answers, jaccard_like=False):
         """Generate a sorted list and scores for a set of subgraphs."""
         # get subgraph statistics
-        print(f'{len(answers)} answers')
-        answers_ = []
-        for answer in answers:
-            answers_.append(self.score(answer, jaccard_like=jaccard_like))
+        logger.debug('Ranking %d answers', len(answers))
+        self.score_all(answers, jaccard_like=jaccard_like)
 
         answers.sort(key=itemgetter('score'), reverse=True)
         return answers
 
+    def rank_top(self, answers, max_results, jaccard_like=False):
+        """Generate a sorted list of the top max_results subgraphs.
+
+        Answers are scored in order of decreasing upper bound on their
+        score (see score_bound), and scoring stops as soon as no remaining
+        answer can beat the current max_results-th best score.
+        Unscored answers are dropped.
+        """
+        logger.debug('Ranking %d answers', len(answers))
+        if max_results == 0:
+            return []
+        if jaccard_like or len(answers) <= max_results:
+            # score / (1 - score) is not monotonic in score, so bounds do not carry over
+            self.score_all(answers, jaccard_like=jaccard_like)
+            return heapq.nlargest(max_results, answers, key=itemgetter('score'))
+
+        rgraphs = [self.get_rgraph(answer) for answer in answers]
+        bounds = self.score_bounds(rgraphs)
+        order = np.argsort(-bounds, kind='stable').tolist()
+
+        top = []  # min-heap of (score, index)
+        num_scored = 0
+        for batch in batches(order, max(max_results, 64)):
+            # leave some slack for numerical error in the exact scores
+            if len(top) == max_results and bounds[batch[0]] * (1 + 1e-6) < top[0][0]:
+                break
+            self.score_all(
+                [answers[idx] for idx in batch],
+                rgraphs=[rgraphs[idx] for idx in batch],
+            )
+            num_scored += len(batch)
+            for idx in batch:
+                item = (answers[idx]['score'], idx)
+                if len(top) < max_results:
+                    heapq.heappush(top, item)
+                elif item > top[0]:
+                    heapq.heapreplace(top, item)
+        stats.increment('score.pruned', len(answers) - num_scored)
+
+        return [answers[idx] for _, idx in sorted(top, reverse=True)]
+
     def score(self, answer, jaccard_like=False):
         """Compute answer score."""
-        # answer is a list of dicts with fields 'id' and 'bound'
-        rgraph = self.get_rgraph(answer)
+        self.score_all([answer], jaccard_like=jaccard_like)
+        return answer
 
-        laplacian = self.graph_laplacian(rgraph)
-        if np.any(np.all(np.abs(laplacian) == 0, axis=0)):
-            answer['score'] = 0
-            return answer
-        nonset_node_ids = [
-            idx for idx, rnode_id in enumerate(rgraph[0])
+    def score_all(self, answers, jaccard_like=False, rgraphs=None):
+        """Compute answer scores.
+
+        Answers are grouped by the size of their rgraph. The Laplacians in
+        each group are stacked and scored with one batched solve.
+        Answers found in the cache are not scored again.
+        """
+        if rgraphs is None:
+            rgraphs = [self.get_rgraph(answer) for answer in answers]
+        if self.cache is not None:
+            keys = [self.cache_key(rgraph, jaccard_like=jaccard_like) for rgraph in rgraphs]
+            cached = self.cache.mget(keys)
+        else:
+            keys = cached = [None] * len(answers)
+
+        groups = defaultdict(list)
+        computed = []
+        for answer, rgraph, key, score in zip(answers, rgraphs, keys, cached):
+            if self.estimator is not None:
+                answer['score_error'] = 0.0
+            if score is not None:
+                answer['score'] = score
+                continue
             if (
-                (rnode_id[0] not in self.qnode_by_id) or
-                (not self.qnode_by_id[rnode_id[0]].get('set', False))
-            )
-        ]
+                    self.estimator is not None and
+                    self.nonset_mask(rgraph).sum() - 1 > self.estimator.probes
+            ):
+                self.score_sparse(answer, rgraph, jaccard_like=jaccard_like, estimate=True)
+                continue
+            groups[len(rgraph[0])].append((answer, rgraph))
+            computed.append((key, answer))
+
+        for num_nodes, group in groups.items():
+            if num_nodes > self.sparse_threshold:
+                for answer, rgraph in group:
+                    self.score_sparse(answer, rgraph, jaccard_like=jaccard_like)
+                continue
+            batch_size = max(1, BATCH_ELEMENTS // (num_nodes * num_nodes))
+            for batch in batches(group, batch_size):
+                laplacians = np.stack([
+                    self.graph_laplacian(rgraph)
+                    for _, rgraph in batch
+                ])
+                masks = np.stack([
+                    self.nonset_mask(rgraph)
+                    for _, rgraph in batch
+                ])
+                isolated = np.any(np.all(laplacians == 0, axis=1), axis=1)
+                with np.errstate(divide='ignore'):
+                    scores = 1 / batch_kirchhoff(laplacians, masks)
+                for (answer, _), score, is_isolated in zip(batch, scores, isolated):
+                    if is_isolated:
+                        answer['score'] = 0
+                        continue
+                    set_score(answer, score, jaccard_like=jaccard_like)
+
+        if self.cache is not None:
+            # estimated scores are not cached
+            self.cache.mset({
+                key: float(answer['score'])
+                for key, answer in computed
+            })
 
-        score = 1 / kirchhoff(laplacian, nonset_node_ids)
+    def score_sparse(self, answer, rgraph, jaccard_like=False, estimate=False):
+        """Compute answer score using a sparse Laplacian.
 
-        # fail safe to nuke nans
-        score = score if np.isfinite(score) and score >= 0 else -1
-        if jaccard_like:
-            answer['score'] = score / (1 - score)
+        This avoids the dense n x n Laplacian for answers with large sets.
+        If estimate is True, the Kirchhoff index is estimated by
+        self.estimator instead of computed exactly.
+        """
+        laplacian = self.sparse_laplacian(rgraph)
+        if np.any(np.asarray(abs(laplacian).sum(axis=0)).ravel() == 0):
+            answer['score'] = 0
+            return
+        keep = np.flatnonzero(self.nonset_mask(rgraph))
+        if estimate:
+            value, error = self.estimator.kirchhoff(laplacian, keep)
         else:
-            answer['score'] = score
-        return answer
+            value, error = sparse_kirchhoff(laplacian, keep), None
+        with np.errstate(divide='ignore'):
+            score = 1 / value
+        set_score(answer, score, jaccard_like=jaccard_like)
+        if error is not None and answer['score'] >= 0:
+            # propagate standard error through score = 1 / value
+            score_error = error * score ** 2
+            if jaccard_like:
+                score_error /= (1 - score) ** 2
+            answer['score_error'] = score_error
+
+    def score_bounds(self, rgraphs):
+        """Get upper bounds on answer scores.
+
+        Like scoring, this is batched over rgraphs of the same size.
+        """
+        bounds = np.empty(len(rgraphs))
+        groups = defaultdict(list)
+        for idx, rgraph in enumerate(rgraphs):
+            groups[len(rgraph[0])].append(idx)
+        for num_nodes, group in groups.items():
+            if num_nodes > self.sparse_threshold:
+                for idx in group:
+                    bounds[idx] = self.score_bound(rgraphs[idx])
+                continue
+            batch_size = max(1, BATCH_ELEMENTS // (num_nodes * num_nodes))
+            for batch in batches(group, batch_size):
+                laplacians = np.stack([
+                    self.graph_laplacian(rgraphs[idx])
+                    for idx in batch
+                ])
+                masks = np.stack([
+                    self.nonset_mask(rgraphs[idx])
+                    for idx in batch
+                ])
+                bounds[batch] = batch_score_bound(laplacians, masks)
+        return bounds
+
+    def score_bound(self, rgraph):
+        """Get upper bound on answer score.
+
+        See batch_score_bound(). This works from the rgraph edges directly,
+        in time linear in their number, instead of a dense Laplacian.
+        """
+        num_nodes = len(rgraph[0])
+        rows, cols, weights = self.rgraph_indices(rgraph)
+        # self-loops do not contribute to the Laplacian
+        rows, cols, weights = rows[rows != cols], cols[rows != cols], weights[rows != cols]
+        degree = (
+            np.bincount(rows, weights, minlength=num_nodes)
+            + np.bincount(cols, weights, minlength=num_nodes)
+        )
+
+        keep = np.flatnonzero(self.nonset_mask(rgraph))
+        num_keep = len(keep)
+        position = np.full(num_nodes, -1)
+        position[keep] = np.arange(num_keep)
+        between_kept = (position[rows] >= 0) & (position[cols] >= 0)
+        direct = np.zeros((num_keep, num_keep))
+        np.add.at(
+            direct,
+            (position[rows[between_kept]], position[cols[between_kept]]),
+            weights[between_kept],
+        )
+        direct += direct.T
+
+        others_x = degree[keep][:, np.newaxis] - direct
+        others_y = degree[keep][np.newaxis, :] - direct
+        with np.errstate(divide='ignore', invalid='ignore'):
+            series = np.where(
+                others_x + others_y > 0,
+                others_x * others_y / (others_x + others_y),
+                0,
+            )
+            resistance = 1 / (direct + series)[np.triu_indices(num_keep, 1)]
+            return 1 / np.sum(resistance)
+
+    def cache_key(self, rgraph, jaccard_like=False):
+        """Get canonical hash of rgraph.
+
+        This depends only on the rnodes, which of them are bound to sets,
+        the weighted redges and the jaccard_like flag, not their order.
+        """
+        node_ids, edges = rgraph
+        nodes = sorted(zip(node_ids, self.nonset_mask(rgraph).tolist()))
+        edges = sorted(
+            (*sorted((edge['source_id'], edge['target_id'])), float(edge['weight']))
+            for edge in edges
+        )
+        return hashlib.blake2b(
+            repr((nodes, edges, jaccard_like)).encode(),
+            digest_size=16,
+        ).hexdigest()
+
+    def nonset_mask(self, rgraph):
+        """Generate indicator vector of rnodes not bound to set qnodes."""
+        return np.array([
+            (rnode_id[0] not in self.qnode_by_id) or
+            (not self.qnode_by_id[rnode_id[0]].get('set', False))
+            for rnode_id in rgraph[0]
+        ], dtype=float)
 
     def graph_laplacian(self, rgraph):
         """Generate graph Laplacian."""
-        node_ids, edges = rgraph
+        num_nodes = len(rgraph[0])
+        rows, cols, weights = self.rgraph_indices(rgraph)
 
         # compute graph laplacian for this case with potentially duplicated nodes
-        num_nodes = len(node_ids)
-        laplacian = np.zeros((num_nodes, num_nodes))
-        index = {node_id: node_ids.index(node_id) for node_id in node_ids}
-        for edge in edges:
-            source_id, target_id, weight = edge['source_id'], edge['target_id'], edge['weight']
-            i, j = index[source_id], index[target_id]
-            laplacian[i, j] += -weight
-            laplacian[j, i] += -weight
-            laplacian[i, i] += weight
-            laplacian[j, j] += weight
-
-        return laplacian
+        laplacian = np.bincount(
+            np.concatenate([rows, cols, rows, cols]) * num_nodes
+            + np.concatenate([cols, rows, rows, cols]),
+            weights=np.concatenate([-weights, -weights, weights, weights]),
+            minlength=num_nodes * num_nodes,
+        )
+        return laplacian.reshape((num_nodes, num_nodes))
+
+    def sparse_laplacian(self, rgraph):
+        """Generate sparse graph Laplacian."""
+        num_nodes = len(rgraph[0])
+        rows, cols, weights = self.rgraph_indices(rgraph)
+        # duplicate entries are summed
+        return sparse.coo_matrix(
+            (
+                np.concatenate([-weights, -weights, weights, weights]),
+                (
+                    np.concatenate([rows, cols, rows, cols]),
+                    np.concatenate([cols, rows, rows, cols]),
+                ),
+            ),
+            shape=(num_nodes, num_nodes),
+        ).tocsc()
+
+    @staticmethod
+    def rgraph_indices(rgraph):
+        """Get rgraph edges as arrays of source indices, target indices and weights."""
+        node_ids, edges = rgraph
+        index = {node_id: idx for idx, node_id in enumerate(node_ids)}
+        rows = np.array([index[edge['source_id']] for edge in edges], dtype=int)
+        cols = np.array([index[edge['target_id']] for edge in edges], dtype=int)
+        weights = np.array([edge['weight'] for edge in edges], dtype=float)
+        return rows, cols, weights
 
     def get_rgraph(self, answer):
-        """Get "ranker" subgraph."""
-        rnodes = set()
+        """Get "ranker" subgraph.
+
+        Rnodes are (qnode id, knode id) pairs. They are indexed by knode id,
+        so that finding the rnodes of each bound edge does not require
+        scanning all of them.
+        """
+        rnodes = dict()
         redges = []
 
         # get list of nodes, and knode_map
-        knode_map = defaultdict(set)
+        knode_map = defaultdict(dict)
         for nb in answer['node_bindings']:
             qnode_id = nb['qg_id']
             knode_id = nb['kg_id']
             rnode_id = (qnode_id, knode_id)
-            rnodes.add(rnode_id)
-            knode_map[knode_id].add(rnode_id)
+            rnodes[rnode_id] = None
+            knode_map[knode_id][rnode_id] = None
             if qnode_id in self.leaf_sets:
                 anchor_id = (f'{qnode_id}_anchor', '')
-                rnodes.add(anchor_id)
+                rnodes[anchor_id] = None
                 redges.append({
                     'weight': 1e9,
                     'source_id': rnode_id,
@@ -135,31 +382,19 @@ class Ranker:
             # if the same knode is bound to multiple qnodes
 
             kedge = self.kedge_by_id[kedge_id]
+            source_rnodes = knode_map.get(kedge['source_id'], {})
+            target_rnodes = knode_map.get(kedge['target_id'], {})
             try:
                 qedge = self.qedge_by_id[qedge_id]
+                qnode_ids = (qedge['source_id'], qedge['target_id'])
                 pairs = list(product(
-                    [
-                        rnode for rnode in rnodes
-                        if rnode[0] in (qedge['source_id'], qedge['target_id']) and rnode[1] == kedge['source_id']
-                    ],
-                    [
-                        rnode for rnode in rnodes
-                        if rnode[0] in (qedge['source_id'], qedge['target_id']) and rnode[1] == kedge['target_id']
-                    ],
+                    [rnode for rnode in source_rnodes if rnode[0] in qnode_ids],
+                    [rnode for rnode in target_rnodes if rnode[0] in qnode_ids],
                 ))
             except KeyError:
                 # a support edge
                 # qedge just needs to contain regex patterns for source and target ids
-                pairs = list(product(
-                    [
-                        rnode for rnode in rnodes
-                        if rnode[1] == kedge['source_id']
-                    ],
-                    [
-                        rnode for rnode in rnodes
-                        if rnode[1] == kedge['target_id']
-                    ],
-                ))
+                pairs = list(product(source_rnodes, target_rnodes))
 
             for source_id, target_id in pairs:
                 edge = {
@@ -172,18 +407,215 @@ class Ranker:
         return rnodes, redges
 
 
+def set_score(answer, score, jaccard_like=False):
+    """Set answer score from the inverse Kirchhoff index."""
+    # fail safe to nuke nans
+    score = score if np.isfinite(score) and score >= 0 else -1
+    if jaccard_like:
+        answer['score'] = score / (1 - score)
+    else:
+        answer['score'] = score
+
+
 def kirchhoff(L, keep):
     """Compute Kirchhoff index, including only specific nodes."""
-    num_nodes = L.shape[0]
-    cols = []
-    for x, y in combinations(keep, 2):
-        d = np.zeros(num_nodes)
-        d[x] = -1
-        d[y] = 1
-        cols.append(d)
-    x = np.stack(cols, axis=1)
-
-    return np.trace(x.T @ np.linalg.lstsq(L, x, rcond=None)[0])
+    mask = np.zeros(L.shape[0])
+    mask[keep] = 1
+    return batch_kirchhoff(L[np.newaxis], mask[np.newaxis])[0]
+
+
+def batch_score_bound(L, mask):
+    """Get upper bounds on the scores of stacked Laplacians.
+
+    Shorting together all nodes but x and y can only lower the
+    effective resistance between them (Rayleigh monotonicity). What is
+    left is the direct conductance w_xy in parallel with the series
+    conductances d_x - w_xy and d_y - w_xy of their other edges,
+    where d is the weighted degree. Summing the resulting resistances
+    gives a lower bound on the Kirchhoff index, and hence an upper bound
+    on the score.
+    """
+    num_nodes = L.shape[-1]
+    degree = np.einsum('bii->bi', L)
+    direct = -L
+    direct[:, np.arange(num_nodes), np.arange(num_nodes)] = 0
+    others_x = degree[:, :, np.newaxis] - direct
+    others_y = degree[:, np.newaxis, :] - direct
+    pairs = np.triu(mask[:, :, np.newaxis] * mask[:, np.newaxis, :], 1) > 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        series = np.where(
+            others_x + others_y > 0,
+            others_x * others_y / (others_x + others_y),
+            0,
+        )
+        resistance = np.where(pairs, 1 / (direct + series), 0)
+        return 1 / np.sum(resistance, axis=(1, 2))
+
+
+def batch_kirchhoff(L, mask):
+    """Compute Kirchhoff indices of stacked Laplacians.
+
+    L has shape (batch, n, n) and mask, the indicator of the nodes to
+    include, has shape (batch, n).
+
+    This is the sum of effective resistances over all pairs of kept nodes.
+    With P the pseudo-inverse of L, R_xy = P_xx + P_yy - 2 P_xy,
+    so the sum over pairs is k * trace(P_kk) - sum(P_kk),
+    where P_kk is P restricted to the k kept nodes.
+
+    P is computed once per Laplacian, with the same singular-value cutoff
+    as the per-pair least-squares solution this replaces. The results agree
+    to a relative 1e-12 for ordinary edge weights and 1e-6 in the presence
+    of the 1e9-weight leaf-set anchor edges.
+    """
+    num_nodes = L.shape[-1]
+    pinv = np.linalg.pinv(
+        L,
+        rcond=num_nodes * np.finfo(L.dtype).eps,
+        hermitian=True,
+    )
+    num_keep = mask.sum(axis=1)
+    trace = np.einsum('bi,bii->b', mask, pinv)
+    total = np.einsum('bi,bij,bj->b', mask, pinv, mask)
+    return num_keep * trace - total
+
+
+def sparse_kirchhoff(L, keep):
+    """Compute Kirchhoff index of a sparse Laplacian, including only specific nodes.
+
+    The graph is grounded at the first kept node: removing its row and
+    column leaves a nonsingular matrix G, and with X = G^-1 restricted to
+    the other kept nodes, R_gx = X_xx and R_xy = X_xx + X_yy - 2 X_xy.
+    The sum over pairs is again k * trace(X) - sum(X). G is factorized
+    once, with one solve per kept node.
+
+    If the kept nodes are not connected, this computes the same
+    pseudo-inverse value as kirchhoff() from each of their connected
+    components instead (see component_pinv).
+    """
+    num_keep = len(keep)
+    if num_keep < 2:
+        return 0.0
+    grounded = ground(L, keep)
+    if grounded is None:
+        # L+ is block-diagonal, so pairs across components contribute
+        # only their diagonal entries
+        keep = np.asarray(keep)
+        _, labels = connected_components(L, directed=False)
+        trace = total = 0.0
+        for label in np.unique(labels[keep]):
+            nodes = np.flatnonzero(labels == label)
+            pinv = component_pinv(L, nodes, np.searchsorted(nodes, keep[labels[keep] == label]))
+            trace += np.trace(pinv)
+            total += np.sum(pinv)
+        return num_keep * trace - total
+    lu, rows = grounded
+    rhs = np.zeros((lu.shape[0], num_keep - 1))
+    rhs[rows, np.arange(num_keep - 1)] = 1
+    x = lu.solve(rhs)[rows]
+    return num_keep * np.trace(x) - np.sum(x)
+
+
+def component_pinv(L, nodes, keep):
+    """Get the pseudo-inverse of the Laplacian of a connected component, restricted to kept nodes.
+
+    nodes are the sorted nodes of the component and keep the positions
+    of the kept nodes among them. With Y = G^-1, grounded at the first node
+    and padded with zeros to n x n, L+ = Q Y Q, where Q = I - 1 1^T / n.
+    Besides the columns of the kept nodes, this needs the row sums r = Y 1:
+    L+_xy = Y_xy - (r_x + r_y) / n + sum(r) / n^2.
+    """
+    num_nodes = len(nodes)
+    num_keep = len(keep)
+    if num_nodes == 1:
+        return np.zeros((num_keep, num_keep))
+    lu = splu(L[nodes[1:]][:, nodes[1:]].tocsc())
+    rhs = np.zeros((num_nodes - 1, num_keep + 1))
+    grounded = keep > 0
+    rhs[keep[grounded] - 1, np.flatnonzero(grounded)] = 1
+    rhs[:, -1] = 1
+    y = np.zeros((num_nodes, num_keep + 1))
+    y[1:] = lu.solve(rhs)
+    row_sums = y[:, -1]
+    return (
+        y[keep, :-1]
+        - (row_sums[keep][:, np.newaxis] + row_sums[keep][np.newaxis, :]) / num_nodes
+        + np.sum(row_sums) / num_nodes ** 2
+    )
+
+
+def ground(L, keep):
+    """Factorize a sparse Laplacian grounded at the first kept node.
+
+    Only the connected component containing the kept nodes is used.
+    Returns the factorization and the rows of the other kept nodes in it,
+    or None if the kept nodes are not connected.
+    """
+    _, labels = connected_components(L, directed=False)
+    if np.any(labels[keep] != labels[keep[0]]):
+        return None
+    nodes = np.flatnonzero(labels == labels[keep[0]])
+    keep = np.searchsorted(nodes, keep)
+    others = np.delete(np.arange(len(nodes)), keep[0])
+    lu = splu(L[nodes[others]][:, nodes[others]].tocsc())
+    return lu, np.searchsorted(others, keep[1:])
+
+
+class KirchhoffEstimator():
+    """Randomized estimator of the restricted Kirchhoff index.
+
+    With C = k I - 1 1^T the Laplacian of the complete graph on the k kept
+    nodes, the restricted Kirchhoff index is trace(L+ C) = k trace(Q L+ Q),
+    where Q centers vectors on the kept nodes. Hutchinson's estimator
+    averages w^T L+ w over centered Rademacher probes w = Q z.
+    Each probe costs one solve with the grounded Laplacian, which is
+    factorized once per answer.
+
+    Probes are drawn in blocks until the relative standard error of the
+    estimate falls below error_target (after at least two blocks),
+    or the number of probes reaches probes.
+    """
+
+    def __init__(self, probes=32, seed=None, error_target=0.05, block_size=8):
+        """Create estimator."""
+        self.probes = probes
+        self.error_target = error_target
+        self.block_size = block_size
+        self.rng = np.random.default_rng(seed)
+
+    def kirchhoff(self, L, keep):
+        """Estimate Kirchhoff index of a sparse Laplacian.
+
+        Returns the estimate and its standard error.
+        """
+        num_keep = len(keep)
+        if num_keep - 1 <= self.probes:
+            return sparse_kirchhoff(L, keep), 0.0
+
+        grounded = ground(L, keep)
+        if grounded is None:
+            return sparse_kirchhoff(L, keep), 0.0
+        # w^T L+ w = w'^T G^-1 w', where w' drops the grounded entry of w
+        lu, rows = grounded
+
+        samples = np.empty(0)
+        while len(samples) < self.probes:
+            block_size = min(self.block_size, self.probes - len(samples))
+            z = self.rng.choice([-1.0, 1.0], size=(num_keep, block_size))
+            w = z - z.mean(axis=0)
+            rhs = np.zeros((lu.shape[0], block_size))
+            rhs[rows] = w[1:]
+            y = lu.solve(rhs)[rows]
+            samples = np.concatenate([
+                samples,
+                num_keep * np.einsum('ij,ij->j', w[1:], y),
+            ])
+            estimate = samples.mean()
+            error = samples.std(ddof=1) / np.sqrt(len(samples))
+            # the standard error of very few samples is itself unreliable
+            if len(samples) >= 2 * self.block_size and error <= self.error_target * abs(estimate):
+                break
+        return estimate, error
 
 
 def matching_subsets(patterns, superset):
@@ -0,0 +1,139 @@
+"""Bounded, prioritized scheduling of database jobs.
+
+All jobs of a worker share MESSENGER_JOB_CONCURRENCY slots, and the jobs
+of one request (see request_scope) hold at most
+MESSENGER_REQUEST_JOB_CONCURRENCY of them. Free slots go to waiting jobs
+by priority (NODES before PAIRS), then in order of arrival, so that
+concurrent requests interleave instead of queueing behind each other.
+"""
+import asyncio
+from contextlib import asynccontextmanager, contextmanager
+import contextvars
+import heapq
+from itertools import count
+import logging
+import os
+
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+JOB_CONCURRENCY = int(os.environ.get('MESSENGER_JOB_CONCURRENCY', '8'))
+REQUEST_JOB_CONCURRENCY = int(os.environ.get('MESSENGER_REQUEST_JOB_CONCURRENCY', '4'))
+# seconds between checks for disconnected clients
+DISCONNECT_POLL = float(os.environ.get('MESSENGER_DISCONNECT_POLL', '0.5'))
+
+NODES = 0
+PAIRS = 1
+
+REQUEST_SLOTS = contextvars.ContextVar('request_slots', default=None)
+
+
+class Scheduler():
+    """Hand out a bounded number of slots by priority."""
+
+    def __init__(self, max_concurrency=JOB_CONCURRENCY):
+        """Create scheduler."""
+        self.max_concurrency = max_concurrency
+        self.running = 0
+        # (priority, arrival, future)
+        self.waiting = []
+        self.arrivals = count()
+
+    async def acquire(self, priority):
+        """Wait for a slot."""
+        if self.running < self.max_concurrency and not self.waiting:
+            self.running += 1
+            return
+        future = asyncio.get_event_loop().create_future()
+        heapq.heappush(self.waiting, (priority, next(self.arrivals), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # the slot was handed over just before cancellation
+                self.release()
+            raise
+
+    def release(self):
+        """Hand slot to the next waiting job, or free it."""
+        while self.waiting:
+            _, _, future = heapq.heappop(self.waiting)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.running -= 1
+
+    async def run(self, job, priority):
+        """Run coroutine job in a slot, and in a slot of the current request if any."""
+        request_slots = REQUEST_SLOTS.get()
+        if request_slots is None:
+            return await self.run_now(job, priority)
+        async with request_slots:
+            return await self.run_now(job, priority)
+
+    async def run_now(self, job, priority):
+        """Run coroutine job in a slot."""
+        try:
+            await self.acquire(priority)
+        except asyncio.CancelledError:
+            job.close()
+            raise
+        try:
+            return await job
+        finally:
+            self.release()
+
+    async def gather(self, jobs, priority):
+        """Run coroutine jobs and return their results in order.
+
+        If one job fails, or gather() is cancelled, the others are cancelled.
+        """
+        tasks = [asyncio.ensure_future(self.run(job, priority)) for job in jobs]
+        try:
+            return await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+SCHEDULER = Scheduler()
+
+
+@contextmanager
+def request_scope(max_concurrency=REQUEST_JOB_CONCURRENCY):
+    """Limit the concurrent jobs of the current request."""
+    token = REQUEST_SLOTS.set(asyncio.Semaphore(max_concurrency))
+    try:
+        yield
+    finally:
+        REQUEST_SLOTS.reset(token)
+
+
+@asynccontextmanager
+async def cancel_on_disconnect(raw_request):
+    """Cancel the current request when its client disconnects.
+
+    Raises HTTPException 499 instead of the cancellation.
+    """
+    task = asyncio.current_task()
+    disconnected = False
+
+    async def watch():
+        """Poll for disconnection."""
+        nonlocal disconnected
+        while not await raw_request.is_disconnected():
+            await asyncio.sleep(DISCONNECT_POLL)
+        logger.info('Client disconnected, cancelling request.')
+        disconnected = True
+        task.cancel()
+
+    watcher = asyncio.ensure_future(watch())
+    try:
+        yield
+    except asyncio.CancelledError:
+        if not disconnected:
+            raise
+        raise HTTPException(status_code=499, detail='Client disconnected.')
+    finally:
+        watcher.cancel()
@@ -0,0 +1,87 @@
+"""Cross-request cache of answer scores.
+
+Scores are keyed by the canonical hash of their rgraph (Ranker.cache_key).
+The in-process LRU is kept per worker. If SCORE_CACHE_REDIS is set,
+misses fall through to, and new scores are written to, the shared Redis
+cache. Redis calls block, so only pool processes (see executor) use
+Redis; scores computed inline on the event loop only use the LRU.
+Set SCORE_CACHE_SIZE to 0 to disable the cache.
+"""
+import logging
+import os
+
+from lru import LRU
+
+from messenger.shared import executor, stats
+from messenger.shared.cache import Cache
+
+logger = logging.getLogger(__name__)
+
+CACHE_HOST = os.environ.get('CACHE_HOST', 'localhost')
+CACHE_PORT = os.environ.get('CACHE_PORT', '6379')
+CACHE_DB = os.environ.get('CACHE_DB', '0')
+CACHE_PASSWORD = os.environ.get('CACHE_PASSWORD', '')
+SCORE_CACHE_SIZE = int(os.environ.get('SCORE_CACHE_SIZE', '100000'))
+SCORE_CACHE_REDIS = os.environ.get('SCORE_CACHE_REDIS', '').lower() in ('1', 'true', 'yes')
+
+
+class ScoreCache():
+    """Two-tier score cache: in-process LRU and optional Redis."""
+
+    def __init__(self, size=SCORE_CACHE_SIZE, redis=None):
+        """Create score cache."""
+        self.lru = LRU(size)
+        self.redis = redis
+
+    @staticmethod
+    def redis_key(key):
+        """Get Redis key."""
+        return f'Ranker_score({key})'
+
+    def mget(self, keys):
+        """Get cached scores, None for misses."""
+        values = [self.lru.get(key) for key in keys]
+        missing = [idx for idx, value in enumerate(values) if value is None]
+        stats.increment('score_cache.lru_hits', len(keys) - len(missing))
+        if missing and self.redis is not None:
+            redis_values = self.redis.mget(*(self.redis_key(keys[idx]) for idx in missing))
+            for idx, value in zip(missing, redis_values):
+                if value is None:
+                    continue
+                values[idx] = self.lru[keys[idx]] = value
+                stats.increment('score_cache.redis_hits')
+        stats.increment('score_cache.misses', sum(value is None for value in values))
+        return values
+
+    def mset(self, scores):
+        """Add scores to the cache."""
+        for key, value in scores.items():
+            self.lru[key] = value
+        if scores and self.redis is not None:
+            self.redis.mset({
+                self.redis_key(key): value
+                for key, value in scores.items()
+            })
+
+
+SCORE_CACHE = None
+
+
+def get_score_cache():
+    """Get the score cache of this process, creating it if necessary."""
+    global SCORE_CACHE  # pylint: disable=global-statement
+    if SCORE_CACHE_SIZE <= 0:
+        return None
+    if SCORE_CACHE is None:
+        redis = None
+        if SCORE_CACHE_REDIS and executor.IN_POOL:
+            redis = Cache(
+                redis_host=CACHE_HOST,
+                redis_port=CACHE_PORT,
+                redis_db=CACHE_DB,
+                redis_password=CACHE_PASSWORD,
+            )
+            if redis.redis is None:
+                redis = None
+        SCORE_CACHE = ScoreCache(redis=redis)
+    return SCORE_CACHE
@@ -0,0 +1,36 @@
+"""Runtime statistics.
+
+Counters are kept per process. Operations run in the executor's process
+pool send their counters back with their results (see executor), so that
+the worker serving the request reports them.
+"""
+from collections import defaultdict
+
+STATS = defaultdict(float)
+
+
+def increment(name, value=1):
+    """Increment counter."""
+    STATS[name] += value
+
+
+def drain():
+    """Return and reset all counters."""
+    deltas = dict(STATS)
+    STATS.clear()
+    return deltas
+
+
+def merge(deltas):
+    """Add counters from another process."""
+    for name, value in deltas.items():
+        STATS[name] += value
+
+
+def snapshot(prefix=''):
+    """Get counters whose names start with prefix."""
+    return {
+        name: value
+        for name, value in sorted(STATS.items())
+        if name.startswith(prefix)
+    }
@@ -2,6 +2,8 @@
 import random
 import string
 
+import numpy as np
+
 
 def random_string(length=10):
     """Return a random N-character-long string."""
@@ -31,3 +33,22 @@ def get_curie_prefix(curie):
     if ':' not in curie:
         raise ValueError('Curies ought to contain a colon')
     return curie.upper().split(':')[0]
+
+
+def sorted_lookup(array, keys):
+    """Find strings in a sorted bytes array, e.g. a memory-mapped one.
+
+    Returns the index of each key, or -1 for keys not in the array.
+    """
+    if not keys:
+        return np.zeros(0, dtype=np.int64)
+    encoded = [key.encode() for key in keys]
+    if not len(array):
+        return np.full(len(encoded), -1, dtype=np.int64)
+    values = np.array(encoded, dtype=array.dtype)
+    idx = np.searchsorted(array, values)
+    found = idx < len(array)
+    found[found] = array[idx[found]] == values[found]
+    # longer keys are truncated by the array dtype
+    found &= np.array([len(key) <= array.dtype.itemsize for key in encoded])
+    return np.where(found, idx, -1)
@@ -0,0 +1,101 @@
+"""Benchmark rgraph construction on bigset-style messages.
+
+Compares Ranker.get_rgraph() and Ranker.graph_laplacian() to the previous
+implementation, which scanned all rnodes for every edge binding and
+indexed nodes with list.index().
+
+Run from the repository root:
+    python -m tests.benchmark_rgraph
+"""
+from collections import defaultdict
+from itertools import product
+import time
+
+import numpy as np
+
+from messenger.shared.ranker_obj import Ranker
+from .test_ranker import bigset_message
+
+
+class LegacyRanker(Ranker):
+    """Ranker with quadratic rgraph construction."""
+
+    def graph_laplacian(self, rgraph):
+        """Generate graph Laplacian."""
+        node_ids, edges = rgraph
+        num_nodes = len(node_ids)
+        laplacian = np.zeros((num_nodes, num_nodes))
+        index = {node_id: node_ids.index(node_id) for node_id in node_ids}
+        for edge in edges:
+            source_id, target_id, weight = edge['source_id'], edge['target_id'], edge['weight']
+            i, j = index[source_id], index[target_id]
+            laplacian[i, j] += -weight
+            laplacian[j, i] += -weight
+            laplacian[i, i] += weight
+            laplacian[j, j] += weight
+        return laplacian
+
+    def get_rgraph(self, answer):
+        """Get "ranker" subgraph."""
+        rnodes = set()
+        redges = []
+        for nb in answer['node_bindings']:
+            qnode_id = nb['qg_id']
+            rnode_id = (qnode_id, nb['kg_id'])
+            rnodes.add(rnode_id)
+            if qnode_id in self.leaf_sets:
+                anchor_id = (f'{qnode_id}_anchor', '')
+                rnodes.add(anchor_id)
+                redges.append({
+                    'weight': 1e9,
+                    'source_id': rnode_id,
+                    'target_id': anchor_id
+                })
+        rnodes = list(rnodes)
+        for eb in answer['edge_bindings']:
+            kedge = self.kedge_by_id[eb['kg_id']]
+            try:
+                qedge = self.qedge_by_id[eb['qg_id']]
+                qnode_ids = (qedge['source_id'], qedge['target_id'])
+            except KeyError:
+                qnode_ids = None
+            pairs = product(
+                [
+                    rnode for rnode in rnodes
+                    if (qnode_ids is None or rnode[0] in qnode_ids) and rnode[1] == kedge['source_id']
+                ],
+                [
+                    rnode for rnode in rnodes
+                    if (qnode_ids is None or rnode[0] in qnode_ids) and rnode[1] == kedge['target_id']
+                ],
+            )
+            for source_id, target_id in pairs:
+                redges.append({
+                    'weight': eb['weight'],
+                    'source_id': source_id,
+                    'target_id': target_id
+                })
+        return rnodes, redges
+
+
+def build_all(ranker, answers):
+    """Build rgraphs and Laplacians for all answers and return elapsed seconds."""
+    start = time.perf_counter()
+    for answer in answers:
+        ranker.graph_laplacian(ranker.get_rgraph(answer))
+    return time.perf_counter() - start
+
+
+def main():
+    """Run benchmark."""
+    print(f"{'set size':>8} {'results':>8} {'legacy (s)':>11} {'indexed (s)':>12} {'speedup':>8}")
+    for max_set_size in (10, 100, 500, 1000):
+        num_results = max(10, 20000 // max_set_size)
+        message = bigset_message(np.random.default_rng(0), num_results, max_set_size)
+        legacy = build_all(LegacyRanker(message), message['results'])
+        indexed = build_all(Ranker(message), message['results'])
+        print(f'{max_set_size:>8} {num_results:>8} {legacy:>11.3f} {indexed:>12.3f} {legacy / indexed:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+"""Test cache."""
+from operator import itemgetter
+import os
+import pickle
+
+import pytest
+import redis
+
+from messenger.shared import stats
+from messenger.shared.cache import IntCacheSerializer, MsgpackCacheSerializer
+from messenger.shared.cache_manager import (
+    CACHE_DB, CACHE_HOST, CACHE_PASSWORD, CACHE_PORT,
+    DISK_BLOCK_SIZE, ENTRY_OVERHEAD, CacheManager, MemoryTier,
+)
+
+REDIS_NAMESPACES = {
+    'test_cache_bucketed': {
+        'ttl': 60,
+        'serializer': 'int',
+        'buckets': 16,
+        'legacy_key': 'test_cache_legacy({})',
+        'legacy_value': itemgetter('count'),
+    },
+    'test_cache_flat': {'ttl': 60, 'serializer': 'int'},
+    'test_cache_bare': {'serializer': 'int', 'key_prefix': ''},
+}
+
+
+@pytest.fixture
+def redis_client():
+    """Get a Redis client, and remove test keys afterwards."""
+    client = redis.StrictRedis(
+        host=CACHE_HOST,
+        port=CACHE_PORT,
+        db=CACHE_DB,
+        password=CACHE_PASSWORD or None,
+    )
+    try:
+        client.ping()
+    except redis.exceptions.ConnectionError:
+        pytest.skip('Redis is unreachable')
+    yield client
+    keys = client.keys('test_cache_*')
+    if keys:
+        client.delete(*keys)
+
+
+def test_memory_tier_eviction():
+    """Test that MemoryTier evicts by size and policy."""
+    # entries are counted with their keys and overhead
+    entry = 1 + 4 + ENTRY_OVERHEAD
+    tier = MemoryTier(max_bytes=2 * entry + 2, policy='lru')
+    for key in 'abc':
+        tier.set(key, key, 4, 0)
+    assert tier.get('a', 0) is None
+    assert tier.get('b', 0) == 'b'
+    tier.set('d', 'd', 4, 0)
+    assert tier.get('c', 0) is None
+    assert tier.get('b', 0) == 'b'
+    assert tier.bytes == 2 * entry
+
+    tier = MemoryTier(max_bytes=2 * entry + 2, policy='fifo')
+    for key in 'abc':
+        tier.set(key, key, 4, 0)
+    assert tier.get('b', 0) == 'b'
+    tier.set('d', 'd', 4, 0)
+    assert tier.get('b', 0) is None
+
+    tier.set('e', 'e', 1, expires=100)
+    assert tier.get('e', 99) == 'e'
+    assert tier.get('e', 101) is None
+
+
+@pytest.mark.asyncio
+async def test_cache_manager_disk_tier(tmp_path):
+    """Test that the disk tier is shared by cache managers."""
+    namespaces = {'counts': {'max_bytes': 1000, 'serializer': 'int'}}
+    writer = CacheManager(namespaces, disk_path=str(tmp_path))
+    reader = CacheManager(namespaces, disk_path=str(tmp_path))
+    for manager in (writer, reader):
+        # skip Redis
+        manager.redis_retry_at = float('inf')
+
+    await writer['counts'].mset({'a': 1, 'b': 0, 'c': None})
+    assert await reader['counts'].mget(['a', 'b', 'c']) == [1, 0, None]
+    assert reader['counts'].info()['entries'] == 2
+
+
+@pytest.mark.asyncio
+async def test_cache_manager_write_buffer(tmp_path):
+    """Test that buffered writes reach the shared tiers at the end, if successful."""
+    namespaces = {'counts': {'max_bytes': 1000, 'serializer': 'int'}}
+    writer = CacheManager(namespaces, disk_path=str(tmp_path))
+    reader = CacheManager(namespaces, disk_path=str(tmp_path))
+    for manager in (writer, reader):
+        # skip Redis
+        manager.redis_retry_at = float('inf')
+
+    async with writer.write_buffer():
+        await writer['counts'].mset({'a': 1})
+        async with writer.write_buffer():
+            await writer['counts'].mset({'b': 2})
+        assert await writer['counts'].mget(['a', 'b']) == [1, 2]
+        assert await reader['counts'].mget(['a', 'b']) == [None, None]
+    assert await reader['counts'].mget(['a', 'b']) == [1, 2]
+
+    with pytest.raises(ValueError):
+        async with writer.write_buffer():
+            await writer['counts'].mset({'c': 3})
+            raise ValueError()
+    assert await writer['counts'].get('c') == 3
+    assert await reader['counts'].get('c') is None
+
+
+@pytest.mark.asyncio
+async def test_cache_manager_disk_sweep(tmp_path):
+    """Test that full disk tiers are swept, oldest files first."""
+    namespaces = {'counts': {'disk_bytes': 10 * DISK_BLOCK_SIZE, 'serializer': 'int'}}
+    manager = CacheManager(namespaces, disk_path=str(tmp_path))
+    manager.redis_retry_at = float('inf')
+    namespace = manager['counts']
+    for idx in range(10):
+        await namespace.mset({f'key{idx}': idx})
+        os.utime(namespace.path(f'key{idx}'), (idx, idx))
+        # the first write measures the disk tier
+        await namespace.sweeping
+    assert len(os.listdir(namespace.disk_path)) == 10
+    assert namespace.info()['disk_usage'] == 10 * DISK_BLOCK_SIZE
+
+    await namespace.mset({'key10': 10})
+    await namespace.sweeping
+    assert len(os.listdir(namespace.disk_path)) == 9
+    assert not os.path.exists(namespace.path('key0'))
+    assert not os.path.exists(namespace.path('key1'))
+    assert namespace.info()['disk_usage'] == 9 * DISK_BLOCK_SIZE
+
+    # expired files are removed first
+    namespace.ttl = 60
+    assert namespace.sweep(now=5 + 60.5) == (5 * DISK_BLOCK_SIZE, 4, 0)
+    assert len(os.listdir(namespace.disk_path)) == 5
+
+
+@pytest.mark.asyncio
+async def test_redis_layout(redis_client):
+    """Test that values are stored in buckets or under namespaced keys."""
+    writer = CacheManager(REDIS_NAMESPACES, disk_path='')
+    await writer['test_cache_bucketed'].mset({'MONDO:1': 1})
+    await writer['test_cache_flat'].mset({'MONDO:1': 2})
+    await writer['test_cache_bare'].mset({'test_cache_MONDO:1': 3})
+
+    bucket = writer['test_cache_bucketed'].bucket('MONDO:1')
+    assert bucket.startswith('test_cache_bucketed:')
+    assert redis_client.hget(bucket, 'MONDO:1') == b'1'
+    assert 0 < redis_client.ttl(bucket) <= 60
+    assert redis_client.get('test_cache_flat:MONDO:1') == b'2'
+    assert 0 < redis_client.ttl('test_cache_flat:MONDO:1') <= 60
+    assert redis_client.get('test_cache_MONDO:1') == b'3'
+
+    reader = CacheManager(REDIS_NAMESPACES, disk_path='')
+    assert await reader['test_cache_bucketed'].mget(['MONDO:1', 'MONDO:2']) == [1, None]
+    assert await reader['test_cache_flat'].get('MONDO:1') == 2
+    await reader['test_cache_flat'].delete(['MONDO:1'])
+    assert redis_client.get('test_cache_flat:MONDO:1') is None
+
+
+@pytest.mark.asyncio
+async def test_legacy_migration(redis_client):
+    """Test that values are read from legacy keys and migrated."""
+    redis_client.set('test_cache_legacy(MONDO:3)', pickle.dumps({'count': 5}))
+    manager = CacheManager(REDIS_NAMESPACES, disk_path='')
+    namespace = manager['test_cache_bucketed']
+    stats.drain()
+    assert await namespace.mget(['MONDO:3', 'MONDO:4']) == [5, None]
+    assert stats.snapshot('cache.test_cache_bucketed.legacy_hits') == {
+        'cache.test_cache_bucketed.legacy_hits': 1,
+    }
+    assert redis_client.hget(namespace.bucket('MONDO:3'), 'MONDO:3') == b'5'
+
+
+def test_serializers():
+    """Test that serializers round-trip values."""
+    assert IntCacheSerializer().dumps(1234) == b'1234'
+    assert IntCacheSerializer().loads(b'1234') == 1234
+    serializer = MsgpackCacheSerializer()
+    value = {'id': 'MONDO:0005737', 'equivalent_identifiers': ['DOID:4325']}
+    assert serializer.loads(serializer.dumps(value)) == value
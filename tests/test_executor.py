@@ -0,0 +1,108 @@
+"""Test executor."""
+import asyncio
+import os
+import time
+
+from fastapi import HTTPException
+import pytest
+
+from messenger.shared import stats
+from messenger.shared.executor import Executor
+
+
+def double(message, *, factor=2):
+    """Multiply message value and count calls."""
+    stats.increment('test_executor.calls')
+    return {'value': message['value'] * factor, 'pid': os.getpid()}
+
+
+async def adouble(message):
+    """Multiply message value asynchronously."""
+    return {'value': message['value'] * 2}
+
+
+def sleep(message):
+    """Sleep for message seconds."""
+    time.sleep(message['value'])
+    return message
+
+
+def die(message):  # pylint: disable=unused-argument
+    """Kill the pool process."""
+    os._exit(1)
+
+
+@pytest.mark.asyncio
+async def test_inline():
+    """Test that operations not in the pool run inline."""
+    executor = Executor(pool_operations='')
+    stats.drain()
+    result = await executor.run(double, {'value': 3}, factor=3)
+    assert result == {'value': 9, 'pid': os.getpid()}
+    assert await executor.run(adouble, {'value': 3}) == {'value': 6}
+    assert stats.snapshot('test_executor') == {'test_executor.calls': 1}
+    assert executor.pool is None
+
+
+@pytest.mark.asyncio
+async def test_pool():
+    """Test that pool operations run in another process and return their statistics."""
+    executor = Executor(pool_operations='test_executor', max_workers=1)
+    stats.drain()
+    try:
+        result = await executor.run(double, {'value': 3})
+        assert result['value'] == 6
+        assert result['pid'] != os.getpid()
+        await executor.run(double, {'value': 3})
+        assert stats.snapshot('test_executor') == {'test_executor.calls': 2}
+    finally:
+        executor.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_broken_pool():
+    """Test that the pool is replaced after a process dies."""
+    executor = Executor(pool_operations='*', max_workers=1)
+    try:
+        with pytest.raises(HTTPException) as excinfo:
+            await executor.run(die, {})
+        assert excinfo.value.status_code == 503
+        assert executor.pool is None
+        assert (await executor.run(double, {'value': 3}))['value'] == 6
+    finally:
+        executor.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_queue_full():
+    """Test that requests are rejected when too many are waiting."""
+    executor = Executor(pool_operations='*', max_workers=1, max_pending=1, max_waiting=1)
+    try:
+        running = asyncio.ensure_future(executor.run(sleep, {'value': 1}))
+        await asyncio.sleep(0)
+        waiting = asyncio.ensure_future(executor.run(sleep, {'value': 0}))
+        await asyncio.sleep(0)
+        with pytest.raises(HTTPException) as excinfo:
+            await executor.run(sleep, {'value': 0})
+        assert excinfo.value.status_code == 503
+        assert await running == {'value': 1}
+        assert await waiting == {'value': 0}
+    finally:
+        executor.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_cancelled():
+    """Test that a cancelled request keeps its slot until its job is done."""
+    executor = Executor(pool_operations='*', max_workers=1, max_pending=1)
+    try:
+        running = asyncio.ensure_future(executor.run(sleep, {'value': 1}))
+        await asyncio.sleep(0.1)
+        running.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await running
+        assert executor.semaphore.locked()
+        assert await executor.run(sleep, {'value': 0}) == {'value': 0}
+        assert not executor.semaphore.locked()
+    finally:
+        executor.shutdown()
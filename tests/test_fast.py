@@ -0,0 +1,97 @@
+"""Test fast endpoints."""
+# pylint: disable=redefined-outer-name,no-name-in-module,unused-import
+# ^^^ this stuff happens because of the incredible way we do pytest fixtures
+import logging
+from types import SimpleNamespace
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+import numpy as np
+import pytest
+from starlette.responses import Response
+
+from messenger import server
+from .fixtures import weighted2
+
+app = FastAPI()
+server.add_operations(app, fast_operations='*')
+client = TestClient(app)
+
+
+async def echo_query(request, *, factor: int = 2):
+    """Echo message."""
+
+
+def echo_process(message, *, factor=2):
+    """Echo message, with numpy values."""
+    return {
+        **message,
+        'scores': np.arange(3) * factor,
+        'score': np.float64(0.5),
+    }
+
+
+@pytest.fixture
+def echo_client(monkeypatch):
+    """Get client of an app with a fast echo operation."""
+    monkeypatch.setitem(server.modules, 'echo', SimpleNamespace(query=echo_query, process=echo_process))
+    echo_app = FastAPI()
+    echo_app.post('/echo', response_class=Response)(
+        server.log_exception(server.fast_endpoint('echo'))
+    )
+    return TestClient(echo_app)
+
+
+def test_fast_parameters(weighted2):
+    """Test that fast endpoints take the query parameters of the module."""
+    response = client.post('/score', json={
+        "message": weighted2
+    })
+    assert response.status_code == 200
+    scored = response.json()
+
+    response = client.post('/screen?max_results=2', json={
+        "message": scored
+    })
+    assert response.status_code == 200
+    assert len(response.json()['results']) == 2
+
+    response = client.post('/screen?max_results=many', json={
+        "message": scored
+    })
+    assert response.status_code == 422
+
+
+def test_fast_malformed(caplog):
+    """Test that malformed bodies are rejected with 422, without logging errors."""
+    with caplog.at_level(logging.ERROR, logger='messenger.server'):
+        response = client.post('/screen', data='not json')
+        assert response.status_code == 422
+        response = client.post('/screen', json={"msg": {}})
+        assert response.status_code == 422
+    assert not caplog.records
+
+
+def test_fast_numpy(echo_client):
+    """Test that numpy values are encoded."""
+    response = echo_client.post('/echo?factor=3', json={
+        "message": {"results": []}
+    })
+    assert response.status_code == 200
+    assert response.json() == {
+        'results': [],
+        'scores': [0, 3, 6],
+        'score': 0.5,
+    }
+
+
+def test_fast_validation(echo_client, monkeypatch):
+    """Test that sampled requests are validated."""
+    message = {"query_graph": "nonsense"}
+    monkeypatch.setattr(server, 'VALIDATION_SAMPLE_RATE', 0)
+    response = echo_client.post('/echo', json={"message": message})
+    assert response.status_code == 200
+
+    monkeypatch.setattr(server, 'VALIDATION_SAMPLE_RATE', 1)
+    response = echo_client.post('/echo', json={"message": message})
+    assert response.status_code == 422
@@ -4,6 +4,7 @@
 import json
 import os
 import pytest
+from messenger.shared.neo4j_ import get_database, shutdown
 from .setup.neo4j_ import get_edge_properties, get_node_properties
 
 NEO4J_URL = os.environ.get('NEO4J_URL', 'http://localhost:7474')
@@ -48,3 +49,19 @@ def test_fail_yank():
     ]
     with pytest.raises(RuntimeError):
         get_node_properties(node_ids, **options)
+
+
+@pytest.mark.asyncio
+async def test_shared_database():
+    """Test that the worker's interface is shared and healthy."""
+    credentials = {
+        "username": NEO4J_USER,
+        "password": NEO4J_PASSWORD,
+    }
+    database = get_database(NEO4J_URL, credentials)
+    assert get_database(NEO4J_URL, credentials) is database
+    await database.health_check()
+    assert await database.arun('RETURN 1 AS ok') == [{'ok': 1}]
+    await shutdown()
+    assert get_database(NEO4J_URL, credentials) is not database
+    await shutdown()
@@ -0,0 +1,98 @@
+"""Test Node Normalization client."""
+from typing import List
+
+from fastapi import FastAPI, HTTPException, Query
+import httpx
+import pytest
+
+from messenger.shared import node_normalizer
+
+NN_URL = 'http://nn/get_normalized_nodes?'
+
+
+def stand_in(failures):
+    """Build a stand-in Node Normalization service.
+
+    The first `failures` requests fail with 503.
+    """
+    app = FastAPI()
+    requests = []
+
+    @app.get('/get_normalized_nodes')
+    async def get_normalized_nodes(curie: List[str] = Query(...)):
+        """Map DOID:x to MONDO:x."""
+        requests.append(curie)
+        if len(requests) <= failures:
+            raise HTTPException(status_code=503)
+        if all(not c.startswith('DOID:') for c in curie):
+            raise HTTPException(status_code=404)
+        return {
+            c: {'id': {'identifier': c.replace('DOID:', 'MONDO:')}} if c.startswith('DOID:') else None
+            for c in curie
+        }
+
+    return app, requests
+
+
+@pytest.mark.asyncio
+async def test_normalize_chunks():
+    """Test that curies are normalized in chunks, with retries."""
+    await node_normalizer.invalidate()
+    app, requests = stand_in(failures=1)
+    node_normalizer.set_client(httpx.AsyncClient(app=app))
+    try:
+        curies = [f'DOID:{idx}' for idx in range(25)] + ['x:NONSENSE', 'x:a/b c']
+        curie_map = await node_normalizer.normalize(curies, url=NN_URL, chunk_size=10)
+    finally:
+        await node_normalizer.close()
+    assert curie_map == {
+        curie: curie.replace('DOID:', 'MONDO:')
+        for curie in curies
+    }
+    assert sorted(len(curie) for curie in requests) == [7, 10, 10, 10]
+
+
+def test_chunks_fit_urls():
+    """Test that chunks are limited by URL length."""
+    long_curie = 'x:' + 'a' * 200
+    curies = [f'MONDO:{idx:07d}' for idx in range(100)] + [long_curie]
+    url = 'http://nn/get_normalized_nodes?'
+    chunked = list(node_normalizer.chunks(curies, url, chunk_size=50, max_url_length=200))
+    assert [curie for chunk in chunked for curie in chunk] == curies
+    assert chunked[-1] == [long_curie]
+    for chunk in chunked[:-1]:
+        assert len(chunk) <= 50
+        assert len(url + '&'.join(map(node_normalizer.curie_parameter, chunk))) <= 200
+
+
+@pytest.mark.asyncio
+async def test_normalize_failure():
+    """Test that failed chunks normalize to their input curies."""
+    await node_normalizer.invalidate()
+    app, _ = stand_in(failures=100)
+    node_normalizer.set_client(httpx.AsyncClient(app=app))
+    try:
+        curie_map = await node_normalizer.normalize(['DOID:1'], url=NN_URL, chunk_size=10)
+    finally:
+        await node_normalizer.close()
+    assert curie_map == {'DOID:1': 'DOID:1'}
+
+
+@pytest.mark.asyncio
+async def test_normalize_cache():
+    """Test that known and unknown curies are cached until invalidated."""
+    await node_normalizer.invalidate()
+    app, requests = stand_in(failures=0)
+    node_normalizer.set_client(httpx.AsyncClient(app=app))
+    try:
+        curies = ['DOID:1', 'x:NONSENSE']
+        expected = {'DOID:1': 'MONDO:1', 'x:NONSENSE': 'x:NONSENSE'}
+        assert await node_normalizer.normalize(curies, url=NN_URL) == expected
+        assert await node_normalizer.normalize(curies, url=NN_URL) == expected
+        assert len(requests) == 1
+
+        await node_normalizer.invalidate(['DOID:1'])
+        assert await node_normalizer.normalize(curies, url=NN_URL) == expected
+        assert requests[-1] == ['DOID:1']
+    finally:
+        await node_normalizer.close()
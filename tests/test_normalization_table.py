@@ -0,0 +1,49 @@
+"""Test normalization table."""
+import json
+
+import pytest
+
+from messenger.shared import node_normalizer
+from messenger.shared.normalization_table import NormalizationTable, build_table
+
+
+@pytest.mark.parametrize('chunk_rows', [1000000, 2])
+@pytest.mark.asyncio
+async def test_normalization_table(tmp_path, chunk_rows):
+    """Test that the table maps synonyms to preferred curies.
+
+    Dumps are read in chunks of chunk_rows synonyms.
+    """
+    compendium = tmp_path / 'disease.txt'
+    compendium.write_text('\n'.join(
+        json.dumps({'type': ['disease'], 'identifiers': [{'i': curie} for curie in identifiers]})
+        for identifiers in (
+            ['MONDO:0005737', 'DOID:4325', 'MESH:D019142'],
+            ['MONDO:0004979', 'DOID:2841'],
+        )
+    ) + '\n')
+    synonyms = tmp_path / 'extra.tsv'
+    synonyms.write_text('UMLS:C0282687\tMONDO:0005737\nDOID:4325\tMONDO:0000000\nUMLS:C0011849\tDOID:2841\n')
+    build_table(str(tmp_path / 'table'), [str(compendium), str(synonyms)], chunk_rows=chunk_rows)
+    table = NormalizationTable(str(tmp_path / 'table'))
+
+    assert table.lookup([
+        'DOID:4325', 'UMLS:C0282687', 'MONDO:0004979', 'UMLS:C0011849', 'MONDO:0000000', 'x:NONSENSE', 'DOID:43250',
+    ]) == {
+        'DOID:4325': 'MONDO:0005737',
+        'UMLS:C0282687': 'MONDO:0005737',
+        'MONDO:0004979': 'MONDO:0004979',
+        'UMLS:C0011849': 'MONDO:0004979',
+        'MONDO:0000000': 'MONDO:0000000',
+        'x:NONSENSE': None,
+        'DOID:43250': None,
+    }
+
+    node_normalizer.set_table(table)
+    try:
+        assert await node_normalizer.normalize(['DOID:2841', 'x:NONSENSE'], backend='local') == {
+            'DOID:2841': 'MONDO:0004979',
+            'x:NONSENSE': 'x:NONSENSE',
+        }
+    finally:
+        node_normalizer.set_table(None)
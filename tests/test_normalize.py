@@ -1,10 +1,13 @@
 """Test normalize."""
 # pylint: disable=redefined-outer-name,no-name-in-module,unused-import
 # ^^^ this stuff happens because of the incredible way we do pytest fixtures
+import copy
+
 from fastapi.testclient import TestClient
 
+from messenger.modules.normalize import collapse_message
 from messenger.server import APP
-from .fixtures import ebola_mondo, nonsense_curie, whatis_doid
+from .fixtures import ebola_mondo, nonsense_curie, whatis_doid, yanked
 
 client = TestClient(APP)
 
@@ -33,3 +36,66 @@ def test_normalize_ebola(ebola_mondo):
         "message": ebola_mondo
     })
     result = response.json()
+
+
+def test_collapse():
+    """Test that collapse_message() merges duplicate nodes, edges and results."""
+    message = {
+        'knowledge_graph': {
+            'nodes': [
+                {'id': 'MONDO:1', 'type': ['disease'], 'name': 'a'},
+                {'id': 'MONDO:1', 'type': ['disease', 'phenotypic_feature'], 'name': 'b'},
+                {'id': 'HP:1', 'type': ['phenotypic_feature']},
+            ],
+            'edges': [
+                {'id': 'e0', 'source_id': 'MONDO:1', 'target_id': 'HP:1', 'type': 'has_phenotype', 'publications': [1]},
+                {'id': 'e1', 'source_id': 'MONDO:1', 'target_id': 'HP:1', 'type': 'has_phenotype', 'publications': [2]},
+                {'id': 'e2', 'source_id': 'MONDO:1', 'target_id': 'HP:1', 'type': 'has_phenotype', 'edge_source': 'omnicorp'},
+            ],
+        },
+        'results': [
+            {
+                'node_bindings': [{'qg_id': 'n0', 'kg_id': 'MONDO:1'}, {'qg_id': 'n1', 'kg_id': 'HP:1'}],
+                'edge_bindings': [{'qg_id': 'e0', 'kg_id': 'e0'}],
+            },
+            {
+                'node_bindings': [{'qg_id': 'n0', 'kg_id': 'MONDO:1'}, {'qg_id': 'n1', 'kg_id': 'HP:1'}],
+                'edge_bindings': [{'qg_id': 'e0', 'kg_id': 'e1'}],
+            },
+        ],
+    }
+    report = collapse_message(message)
+    assert report == {
+        'nodes': {'before': 3, 'after': 2},
+        'edges': {'before': 3, 'after': 2},
+        'results': {'before': 2, 'after': 1},
+    }
+    node = message['knowledge_graph']['nodes'][0]
+    assert node['type'] == ['disease', 'phenotypic_feature']
+    assert node['name'] == 'a'
+    assert message['knowledge_graph']['edges'][0]['publications'] == [1, 2]
+    assert message['results'][0]['edge_bindings'] == [{'qg_id': 'e0', 'kg_id': 'e0'}]
+
+
+def test_collapse_sets(yanked):
+    """Test that collapse_message() remaps list-valued edge bindings."""
+    message = copy.deepcopy(yanked)
+    binding = message['results'][0]['edge_bindings'][0]
+    edge = next(
+        edge for edge in message['knowledge_graph']['edges']
+        if edge['id'] == binding['kg_id'][0]
+    )
+    # a duplicate of the edge, bound alongside it
+    message['knowledge_graph']['edges'].append({**edge, 'id': 'duplicate'})
+    binding['kg_id'] = binding['kg_id'] + ['duplicate']
+
+    report = collapse_message(message)
+    assert report['edges']['after'] < report['edges']['before']
+    edge_ids = {edge['id'] for edge in message['knowledge_graph']['edges']}
+    assert 'duplicate' not in edge_ids
+    assert binding['kg_id'].count(edge['id']) == 1
+    for result in message['results']:
+        for binding in result['edge_bindings']:
+            assert isinstance(binding['kg_id'], list)
+            assert len(set(binding['kg_id'])) == len(binding['kg_id'])
+            assert set(binding['kg_id']) <= edge_ids
@@ -0,0 +1,94 @@
+"""Test Omnicorp index."""
+from collections import defaultdict
+from itertools import combinations
+
+import numpy as np
+import pytest
+
+from messenger.shared import omnicorp
+from messenger.shared.omnicorp_index import OmnicorpIndex, build_index
+from messenger.shared.omnicorp_sketch import OmnicorpSketches, build_sketches
+
+
+@pytest.mark.parametrize('chunk_rows,overlap', [(1000000, False), (7, True)])
+@pytest.mark.asyncio
+async def test_omnicorp_index(tmp_path, chunk_rows, overlap):
+    """Test that index counts match counting the CSV rows.
+
+    Files are read in chunks of chunk_rows, and share curies if overlap.
+    """
+    rng = np.random.default_rng(0)
+    curies = [f'MONDO:{idx:07d}' for idx in range(50)] + [f'HGNC:{idx}' for idx in range(50)]
+    pmids = defaultdict(set)
+    paths = []
+    for prefix in ('MONDO', 'HGNC') + (('',) if overlap else ()):
+        path = tmp_path / f'omnicorp_{prefix.lower() or "all"}.csv'
+        rows = ['curie,pubmedid']
+        for _ in range(2000):
+            curie = curies[rng.integers(len(curies))]
+            if not curie.startswith(prefix):
+                continue
+            pmid = int(rng.integers(300))
+            pmids[curie].add(pmid)
+            rows.append(f'{curie},{pmid}')
+        path.write_text('\n'.join(rows) + '\n')
+        paths.append(str(path))
+    build_index(str(tmp_path / 'index'), paths, chunk_rows=chunk_rows)
+    index = OmnicorpIndex(str(tmp_path / 'index'))
+
+    nodes = curies + ['MONDO:nope', 'MONDO:00000001']
+    counts = await index.count_pmids_many(nodes)
+    assert counts == {node: len(pmids[node]) for node in nodes}
+
+    pairs = list(combinations(nodes, 2))
+    counts = await index.get_shared_pmids_count_many(pairs)
+    assert counts == {
+        (node1, node2): len(pmids[node1] & pmids[node2])
+        for node1, node2 in pairs
+    }
+
+
+def test_omnicorp_sketches(tmp_path):
+    """Test that sketch estimates are exact for small sets and close for large ones."""
+    rng = np.random.default_rng(1)
+    pmids = {
+        f'MONDO:{idx}': set(rng.choice(5000, size=size, replace=False).tolist())
+        for idx, size in enumerate(rng.integers(1, 2000, size=100))
+    }
+    path = tmp_path / 'omnicorp_mondo.csv'
+    path.write_text('curie,pubmedid\n' + ''.join(
+        f'{curie},{pmid}\n'
+        for curie, values in pmids.items()
+        for pmid in values
+    ))
+    build_index(str(tmp_path / 'index'), [str(path)])
+    build_sketches(str(tmp_path / 'index'), size=256)
+    sketches = OmnicorpSketches(str(tmp_path / 'index'))
+
+    pairs = list(combinations(pmids, 2)) + [('MONDO:0', 'MONDO:nope')]
+    estimates = sketches.estimate_shared_pmids_count_many(pairs)
+    errors = []
+    for node1, node2 in pairs:
+        expected = len(pmids.get(node1, set()) & pmids.get(node2, set()))
+        if max(len(pmids.get(node1, ())), len(pmids.get(node2, ()))) <= 256:
+            assert estimates[(node1, node2)] == expected
+        elif expected >= 100:
+            errors.append(estimates[(node1, node2)] / expected - 1)
+    assert abs(np.mean(errors)) < 0.02
+    assert np.median(np.abs(errors)) < 0.1
+
+
+def test_omnicorp_sketches_missing(tmp_path, monkeypatch):
+    """Test that counts can only be estimated once sketches are built."""
+    path = tmp_path / 'omnicorp_mondo.csv'
+    path.write_text('curie,pubmedid\nMONDO:1,1\nMONDO:2,1\n')
+    build_index(str(tmp_path / 'index'), [str(path)])
+    monkeypatch.setattr(omnicorp, 'OMNICORP_INDEX_PATH', str(tmp_path / 'index'))
+    monkeypatch.setattr(omnicorp, 'OMNICORP_SKETCH_PATH', str(tmp_path / 'index'))
+    monkeypatch.setattr(omnicorp, 'INDEX', None)
+    monkeypatch.setattr(omnicorp, 'SKETCHES', None)
+    supporter = omnicorp.OmnicorpSupport(backend='index')
+    assert not supporter.can_estimate()
+
+    build_sketches(str(tmp_path / 'index'))
+    assert supporter.can_estimate()
@@ -0,0 +1,42 @@
+"""Test pipeline."""
+# pylint: disable=redefined-outer-name,no-name-in-module,unused-import
+# ^^^ this stuff happens because of the incredible way we do pytest fixtures
+from fastapi.testclient import TestClient
+
+from messenger.server import APP
+from .fixtures import weighted2
+
+client = TestClient(APP)
+
+
+def test_pipeline(weighted2):
+    """Test that pipeline() matches chained calls."""
+    response = client.post('/pipeline', json={
+        "message": weighted2,
+        "operations": [
+            {"operation": "score"},
+            {"operation": "screen", "parameters": {"max_results": 3}},
+        ],
+    })
+    result = response.json()
+    assert len(result['results']) == 3
+
+    response = client.post('/score', json={
+        "message": weighted2
+    })
+    response = client.post('/screen?max_results=3', json={
+        "message": response.json()
+    })
+    expected = response.json()
+    assert [r['score'] for r in result['results']] == [r['score'] for r in expected['results']]
+
+
+def test_pipeline_bad_parameters(weighted2):
+    """Test that pipeline() rejects unknown parameters."""
+    response = client.post('/pipeline', json={
+        "message": weighted2,
+        "operations": [
+            {"operation": "screen", "parameters": {"max_result": 3}},
+        ],
+    })
+    assert response.status_code == 422
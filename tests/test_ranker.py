@@ -0,0 +1,321 @@
+"""Test ranker."""
+# pylint: disable=redefined-outer-name,no-name-in-module,unused-import
+# ^^^ this stuff happens because of the incredible way we do pytest fixtures
+import copy
+from itertools import combinations
+
+import numpy as np
+from scipy import sparse
+
+from messenger.shared import score_cache, stats
+from messenger.shared.ranker_obj import KirchhoffEstimator, Ranker, kirchhoff, sparse_kirchhoff
+from messenger.shared.score_cache import ScoreCache, get_score_cache
+from .fixtures import weighted2
+
+
+def reference_kirchhoff(L, keep):
+    """Compute Kirchhoff index with one least-squares column per pair."""
+    num_nodes = L.shape[0]
+    cols = []
+    for x, y in combinations(keep, 2):
+        d = np.zeros(num_nodes)
+        d[x] = -1
+        d[y] = 1
+        cols.append(d)
+    x = np.stack(cols, axis=1)
+    return np.trace(x.T @ np.linalg.lstsq(L, x, rcond=None)[0])
+
+
+def random_laplacian(rng, num_nodes, anchor=False):
+    """Generate the Laplacian of a random connected weighted graph."""
+    weights = rng.random((num_nodes, num_nodes))
+    weights *= rng.random((num_nodes, num_nodes)) < 0.3
+    weights = np.triu(weights, 1)
+    for idx in range(num_nodes - 1):
+        weights[idx, idx + 1] = max(weights[idx, idx + 1], 0.1)
+    if anchor:
+        weights[0, num_nodes - 1] = 1e9
+    weights += weights.T
+    return np.diag(weights.sum(axis=1)) - weights
+
+
+def bigset_message(rng, num_results, max_set_size):
+    """Generate a bigset-style message.
+
+    (n00)--(n01)--(n02 set)--(n03)--(n04)
+    """
+    qnodes = [
+        {'id': 'n00', 'curie': 'x:start', 'type': 'A'},
+        {'id': 'n01', 'type': 'B'},
+        {'id': 'n02', 'type': 'C', 'set': True},
+        {'id': 'n03', 'type': 'D'},
+        {'id': 'n04', 'curie': 'x:end', 'type': 'E'},
+    ]
+    qedges = [
+        {'id': f'e0{idx}', 'source_id': f'n0{idx}', 'target_id': f'n0{idx + 1}'}
+        for idx in range(4)
+    ]
+    kedge_ids = set()
+    kedges = []
+    results = []
+
+    def add_edge(qedge_id, source_id, target_id):
+        """Add knowledge graph edge and return edge binding."""
+        kedge_id = f'{source_id}-{target_id}'
+        if kedge_id not in kedge_ids:
+            kedge_ids.add(kedge_id)
+            kedges.append({
+                'id': kedge_id,
+                'source_id': source_id,
+                'target_id': target_id,
+                'type': 'related_to',
+            })
+        return {'qg_id': qedge_id, 'kg_id': kedge_id, 'weight': rng.random() + 0.1}
+
+    for idx in range(num_results):
+        b_id = f'x:b{rng.integers(num_results)}'
+        d_id = f'x:d{rng.integers(num_results)}'
+        c_ids = sorted({
+            f'x:c{cdx}'
+            for cdx in rng.integers(10 * max_set_size, size=rng.integers(1, max_set_size + 1))
+        })
+        node_bindings = [
+            {'qg_id': 'n00', 'kg_id': 'x:start'},
+            {'qg_id': 'n01', 'kg_id': b_id},
+            *({'qg_id': 'n02', 'kg_id': c_id} for c_id in c_ids),
+            {'qg_id': 'n03', 'kg_id': d_id},
+            {'qg_id': 'n04', 'kg_id': 'x:end'},
+        ]
+        edge_bindings = [
+            add_edge('e00', 'x:start', b_id),
+            *(add_edge('e01', b_id, c_id) for c_id in c_ids),
+            *(add_edge('e02', c_id, d_id) for c_id in c_ids),
+            add_edge('e03', d_id, 'x:end'),
+            add_edge(f's{idx}', b_id, d_id),
+        ]
+        results.append({
+            'node_bindings': node_bindings,
+            'edge_bindings': edge_bindings,
+        })
+    node_ids = {
+        nb['kg_id']
+        for result in results
+        for nb in result['node_bindings']
+    }
+    return {
+        'query_graph': {'nodes': qnodes, 'edges': qedges},
+        'knowledge_graph': {
+            'nodes': [{'id': node_id, 'type': 'named_thing'} for node_id in sorted(node_ids)],
+            'edges': kedges,
+        },
+        'results': results,
+    }
+
+
+def reference_scores(message):
+    """Score answers one at a time with the pairwise least-squares solution."""
+    ranker = Ranker(message)
+    scores = []
+    for answer in message['results']:
+        rgraph = ranker.get_rgraph(answer)
+        laplacian = ranker.graph_laplacian(rgraph)
+        if np.any(np.all(np.abs(laplacian) == 0, axis=0)):
+            scores.append(0)
+            continue
+        keep = [
+            idx for idx, rnode_id in enumerate(rgraph[0])
+            if not ranker.qnode_by_id.get(rnode_id[0], {}).get('set', False)
+        ]
+        scores.append(1 / reference_kirchhoff(laplacian, keep))
+    return scores
+
+
+def test_kirchhoff():
+    """Test that kirchhoff() matches the pairwise least-squares solution."""
+    rng = np.random.default_rng(0)
+    for _ in range(100):
+        num_nodes = rng.integers(3, 30)
+        laplacian = random_laplacian(rng, num_nodes)
+        keep = sorted(rng.choice(num_nodes, rng.integers(2, num_nodes + 1), replace=False))
+        assert np.isclose(
+            kirchhoff(laplacian, keep),
+            reference_kirchhoff(laplacian, keep),
+            rtol=1e-12,
+        )
+
+
+def test_kirchhoff_anchored():
+    """Test that kirchhoff() handles leaf-set anchor weights."""
+    rng = np.random.default_rng(1)
+    for _ in range(100):
+        num_nodes = rng.integers(3, 30)
+        laplacian = random_laplacian(rng, num_nodes, anchor=True)
+        keep = sorted(rng.choice(num_nodes, rng.integers(2, num_nodes + 1), replace=False))
+        assert np.isclose(
+            kirchhoff(laplacian, keep),
+            reference_kirchhoff(laplacian, keep),
+            rtol=1e-6,
+        )
+
+
+def test_rank(weighted2):
+    """Test that rank() matches scoring answers one at a time."""
+    message = copy.deepcopy(weighted2)
+    expected = reference_scores(message)
+    Ranker(message).score_all(message['results'])
+    assert np.allclose(
+        [answer['score'] for answer in message['results']],
+        expected,
+        rtol=1e-12,
+    )
+
+
+def test_rank_bigset():
+    """Test that rank() matches scoring bigset answers one at a time."""
+    message = bigset_message(np.random.default_rng(2), 50, 8)
+    expected = reference_scores(message)
+    Ranker(message).score_all(message['results'])
+    assert np.allclose(
+        [answer['score'] for answer in message['results']],
+        expected,
+        rtol=1e-12,
+    )
+
+
+def test_graph_laplacian():
+    """Test that graph_laplacian() accumulates every rgraph edge."""
+    message = bigset_message(np.random.default_rng(3), 20, 8)
+    ranker = Ranker(message)
+    for answer in message['results']:
+        node_ids, edges = rgraph = ranker.get_rgraph(answer)
+        expected = np.zeros((len(node_ids), len(node_ids)))
+        for edge in edges:
+            i = node_ids.index(edge['source_id'])
+            j = node_ids.index(edge['target_id'])
+            expected[[i, j], [j, i]] -= edge['weight']
+            expected[[i, j], [i, j]] += edge['weight']
+        assert np.allclose(ranker.graph_laplacian(rgraph), expected)
+
+
+def test_sparse_kirchhoff():
+    """Test that sparse_kirchhoff() matches kirchhoff()."""
+    rng = np.random.default_rng(4)
+    for idx in range(100):
+        num_nodes = rng.integers(3, 30)
+        laplacian = random_laplacian(rng, num_nodes, anchor=idx % 2)
+        keep = sorted(rng.choice(num_nodes, rng.integers(2, num_nodes + 1), replace=False))
+        assert np.isclose(
+            sparse_kirchhoff(sparse.csc_matrix(laplacian), keep),
+            kirchhoff(laplacian, keep),
+            rtol=1e-6,
+        )
+
+
+def test_sparse_kirchhoff_disconnected():
+    """Test that sparse_kirchhoff() matches kirchhoff() when the kept nodes are not connected."""
+    # two 2-node components
+    laplacian = np.array([
+        [1, -1, 0, 0],
+        [-1, 1, 0, 0],
+        [0, 0, 1, -1],
+        [0, 0, -1, 1],
+    ], dtype=float)
+    assert np.isclose(sparse_kirchhoff(sparse.csc_matrix(laplacian), [0, 1, 2, 3]), 4.0)
+    assert np.isclose(kirchhoff(laplacian, [0, 1, 2, 3]), 4.0)
+
+    rng = np.random.default_rng(9)
+    for _ in range(50):
+        sizes = rng.integers(1, 10, size=rng.integers(2, 4))
+        laplacian = np.zeros((sum(sizes), sum(sizes)))
+        start = 0
+        for size in sizes:
+            laplacian[start:start + size, start:start + size] = random_laplacian(rng, size)
+            start += size
+        num_nodes = len(laplacian)
+        keep = sorted(rng.choice(num_nodes, rng.integers(2, num_nodes + 1), replace=False))
+        assert np.isclose(
+            sparse_kirchhoff(sparse.csc_matrix(laplacian), keep),
+            kirchhoff(laplacian, keep),
+            rtol=1e-6,
+        )
+
+
+def test_rank_sparse():
+    """Test that sparse scoring matches dense scoring."""
+    message = bigset_message(np.random.default_rng(5), 50, 8)
+    expected = reference_scores(message)
+    Ranker(message, sparse_threshold=0).score_all(message['results'])
+    assert np.allclose(
+        [answer['score'] for answer in message['results']],
+        expected,
+        rtol=1e-9,
+    )
+
+
+def test_kirchhoff_estimator():
+    """Test that estimated Kirchhoff indices are within their standard error."""
+    rng = np.random.default_rng(6)
+    for seed in range(20):
+        laplacian = random_laplacian(rng, 200)
+        keep = np.arange(0, 200, 2)
+        estimator = KirchhoffEstimator(probes=64, seed=seed, error_target=0.02)
+        estimate, error = estimator.kirchhoff(sparse.csc_matrix(laplacian), keep)
+        assert 0 < error < 0.1 * estimate
+        assert abs(estimate - kirchhoff(laplacian, keep)) < 5 * error
+
+
+def test_rank_approximate():
+    """Test that answers with few non-set nodes are scored exactly."""
+    message = bigset_message(np.random.default_rng(7), 20, 8)
+    expected = reference_scores(message)
+    estimator = KirchhoffEstimator(probes=3, seed=0)
+    Ranker(message, estimator=estimator).score_all(message['results'])
+    assert np.allclose(
+        [answer['score'] for answer in message['results']],
+        expected,
+        rtol=1e-12,
+    )
+    assert all(answer['score_error'] == 0 for answer in message['results'])
+
+
+def test_rank_cached():
+    """Test that cached scores are reused across messages."""
+    cache = ScoreCache(size=1000)
+    message = bigset_message(np.random.default_rng(8), 20, 8)
+    Ranker(message, cache=cache).score_all(message['results'])
+    expected = [answer['score'] for answer in message['results']]
+
+    misses = stats.STATS['score_cache.misses']
+    message = copy.deepcopy(message)
+    for answer in message['results']:
+        answer.pop('score')
+        answer['edge_bindings'].reverse()
+    Ranker(message, cache=cache).score_all(message['results'])
+    assert [answer['score'] for answer in message['results']] == expected
+    assert stats.STATS['score_cache.misses'] == misses
+
+
+def test_score_cache_inline(monkeypatch):
+    """Test that scores computed inline do not use the blocking Redis tier."""
+    monkeypatch.setattr(score_cache, 'SCORE_CACHE_REDIS', True)
+    monkeypatch.setattr(score_cache, 'SCORE_CACHE', None)
+    assert get_score_cache().redis is None
+
+
+def test_score_bound():
+    """Test that score_bound() bounds the score from above."""
+    message = bigset_message(np.random.default_rng(9), 100, 8)
+    ranker = Ranker(message)
+    ranker.score_all(message['results'])
+    for answer in message['results']:
+        assert ranker.score_bound(ranker.get_rgraph(answer)) >= answer['score']
+
+
+def test_rank_top():
+    """Test that rank_top() matches the top of rank()."""
+    message = bigset_message(np.random.default_rng(10), 500, 8)
+    expected = Ranker(message).rank(copy.deepcopy(message['results']))[:10]
+    pruned = stats.STATS['score.pruned']
+    top = Ranker(message).rank_top(message['results'], 10)
+    assert [answer['score'] for answer in top] == [answer['score'] for answer in expected]
+    assert stats.STATS['score.pruned'] > pruned
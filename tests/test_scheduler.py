@@ -0,0 +1,89 @@
+"""Test scheduler."""
+import asyncio
+
+import pytest
+
+from messenger.shared.omnicorp import OmnicorpSupport
+from messenger.shared.scheduler import NODES, PAIRS, REQUEST_SLOTS, Scheduler, request_scope
+
+
+@pytest.mark.asyncio
+async def test_scheduler_limits():
+    """Test that jobs stay within the worker and request limits."""
+    scheduler = Scheduler(max_concurrency=3)
+    running = {'worker': 0, 'a': 0, 'b': 0}
+    peaks = dict(running)
+
+    async def job(name):
+        """Count concurrent jobs."""
+        for key in ('worker', name):
+            running[key] += 1
+            peaks[key] = max(peaks[key], running[key])
+        await asyncio.sleep(0.001)
+        for key in ('worker', name):
+            running[key] -= 1
+        return name
+
+    async def request(name):
+        """Run the jobs of one request."""
+        with request_scope(max_concurrency=2):
+            return await scheduler.gather((job(name) for _ in range(20)), priority=PAIRS)
+
+    results = await asyncio.gather(request('a'), request('b'))
+    assert results == [['a'] * 20, ['b'] * 20]
+    assert peaks == {'worker': 3, 'a': 2, 'b': 2}
+    assert scheduler.running == 0
+
+
+@pytest.mark.asyncio
+async def test_scheduler_priority():
+    """Test that waiting node jobs run before waiting pair jobs."""
+    scheduler = Scheduler(max_concurrency=1)
+    order = []
+
+    async def job(name):
+        """Record job."""
+        order.append(name)
+        await asyncio.sleep(0)
+
+    await asyncio.gather(
+        scheduler.gather([job('pairs0'), job('pairs1')], priority=PAIRS),
+        scheduler.gather([job('nodes0'), job('nodes1')], priority=NODES),
+    )
+    assert order == ['pairs0', 'nodes0', 'nodes1', 'pairs1']
+
+
+@pytest.mark.asyncio
+async def test_scheduler_cancel():
+    """Test that cancelled jobs give back their slots."""
+    scheduler = Scheduler(max_concurrency=1)
+    task = asyncio.ensure_future(scheduler.gather(
+        (asyncio.sleep(1) for _ in range(5)),
+        priority=PAIRS,
+    ))
+    await asyncio.sleep(0.01)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    await asyncio.sleep(0)
+    assert scheduler.running == 0
+    assert await scheduler.gather([asyncio.sleep(0, 'done')], priority=NODES) == ['done']
+
+
+@pytest.mark.asyncio
+async def test_support_scope_failed_connect():
+    """Test that the request scope is left when Omnicorp cannot be reached."""
+
+    class Unreachable():
+        """Omnicorp backend that fails to connect."""
+
+        async def connect(self):
+            """Fail."""
+            raise OSError('unreachable')
+
+    support = OmnicorpSupport(backend='postgres')
+    support.omnicorp = Unreachable()
+    with pytest.raises(OSError):
+        async with support:
+            pass
+    assert REQUEST_SLOTS.get() is None
@@ -3,7 +3,9 @@
 # ^^^ this stuff happens because of the incredible way we do pytest fixtures
 from fastapi.testclient import TestClient
 
+from messenger.modules.support import plan_pairs
 from messenger.server import APP
+from messenger.shared import omnicorp
 from .fixtures import yanked
 
 client = TestClient(APP)
@@ -19,3 +21,51 @@ def test_support(yanked):
         edge['type'] == 'literature_co-occurrence'
         for edge in result['knowledge_graph']['edges']
     )
+
+
+def test_support_approximate_without_sketches(yanked, tmp_path, monkeypatch):
+    """Test that approximate support counts exactly when there are no sketches."""
+    monkeypatch.setattr(omnicorp, 'OMNICORP_SKETCH_PATH', str(tmp_path))
+    monkeypatch.setattr(omnicorp, 'SKETCHES', None)
+    response = client.post('/support?mode=approximate', json={
+        "message": yanked
+    })
+    assert response.status_code == 200
+    edges = [
+        edge
+        for edge in response.json()['knowledge_graph']['edges']
+        if edge['type'] == 'literature_co-occurrence'
+    ]
+    assert edges
+    assert not any(edge['num_publications_estimated'] for edge in edges)
+
+
+def test_plan_pairs():
+    """Test that plan_pairs() keeps the pairs of the best answers within budget."""
+    answers = [
+        {
+            'score': 0.1,
+            'node_bindings': [
+                {'qg_id': 'n0', 'kg_id': 'x:a'},
+                {'qg_id': 'n1', 'kg_id': 'x:b'},
+            ],
+        },
+        {
+            'score': 0.9,
+            'node_bindings': [
+                {'qg_id': 'n0', 'kg_id': 'x:a'},
+                {'qg_id': 'n1', 'kg_id': 'x:c'},
+                {'qg_id': 'n2', 'kg_id': ['x:d', 'x:e']},
+            ],
+        },
+    ]
+    pair_to_answer, skipped = plan_pairs(answers)
+    assert len(pair_to_answer) == 6
+    assert skipped == []
+
+    pair_to_answer, skipped = plan_pairs(answers, max_pairs=4)
+    assert list(pair_to_answer) == [('x:a', 'x:c'), ('x:a', 'x:d'), ('x:c', 'x:d'), ('x:a', 'x:e')]
+    assert skipped == [('x:c', 'x:e'), ('x:a', 'x:b')]
+
+    pair_to_answer, skipped = plan_pairs(answers, max_pairs=2, prioritize='order')
+    assert list(pair_to_answer) == [('x:a', 'x:b'), ('x:a', 'x:c')]